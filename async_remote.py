@@ -0,0 +1,118 @@
+import time
+import asyncio
+
+from remote import poll_channel
+from core import get_logger
+from utils.declare import JobResult
+from utils.runner import StderrTail, make_result
+import settings
+
+logger = get_logger()
+
+
+class AsyncRemoteEngine:
+    '''使用asyncio在连接池复用的SSH连接上并发执行远程命令
+
+    每个命令是一个非阻塞的通道, 等待数据时不占用线程, 只有打开通道等
+    需要与服务器往返的操作放到线程池中执行.
+    global_limit限制同时执行的命令总数, host_limit限制每个主机同时执行的命令数.
+    '''
+
+    def __init__(self, global_limit=None, host_limit=None):
+        self._global = asyncio.Semaphore(global_limit or settings.AIO_MAX_JOBS)
+        self._host_limit = host_limit or settings.AIO_HOST_JOBS
+        self._hosts = {}
+
+    def _host_semaphore(self, host):
+        if host not in self._hosts:
+            self._hosts[host] = asyncio.Semaphore(self._host_limit)
+        return self._hosts[host]
+
+    async def exec_stream(self, server, command, sinks=(), chunk_size=None, tail_lines=None, timeout=None):
+        '''与RemoteServer.exec_stream相同, 返回RunResult
+
+        sinks也可以是返回sink列表的函数, 在取得执行名额后才调用, 排队的任务不会提前打开文件或开始计时.
+        '''
+        # 先占主机名额再占全局名额, 排队等待繁忙主机的任务不占用全局名额, 其他主机不会被饿死
+        async with self._host_semaphore(server.host), self._global:
+            if callable(sinks):
+                sinks = sinks()
+            return await self._exec_stream(server, command, sinks, chunk_size, tail_lines, timeout)
+
+    async def _exec_stream(self, server, command, sinks, chunk_size, tail_lines, timeout):
+        loop = asyncio.get_running_loop()
+        chunk_size = chunk_size or settings.STREAM_CHUNK_SIZE
+        timeout = timeout or settings.SSH_CMD_TIMEOUT
+        start = time.time()
+        deadline = start + timeout if timeout else None
+        tail = StderrTail(tail_lines)
+        nbytes, retries = 0, []
+
+        session = server.session(on_retry=lambda: retries.append(1))
+        channel = await loop.run_in_executor(None, session.__enter__)
+        try:
+            await loop.run_in_executor(None, channel.exec_command, command)
+            channel.shutdown_write()
+            while True:
+                chunks, done = poll_channel(channel, tail, chunk_size)
+                for chunk in chunks:
+                    nbytes += len(chunk)
+                    for sink in sinks:
+                        sink.write(chunk)
+                if done:
+                    break
+                if deadline and time.time() > deadline:
+                    raise TimeoutError(f"命令执行超时({timeout}秒)")
+                if not chunks:
+                    await self._wait_readable(channel)
+            returncode = await loop.run_in_executor(None, channel.recv_exit_status)
+        except TimeoutError as e:
+            tail.write(str(e).encode(settings.REMOTE_ENCODING))
+            returncode = -1
+        finally:
+            for sink in sinks:
+                sink.close()
+            await loop.run_in_executor(None, session.__exit__, None, None, None)
+        tail.close()
+        return make_result([returncode], [tail], nbytes, start, settings.REMOTE_ENCODING, len(retries))
+
+    @staticmethod
+    async def _wait_readable(channel):
+        '''等待通道可读, 事件循环不支持add_reader时退回到定时轮询'''
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        fd = channel.fileno()
+        try:
+            loop.add_reader(fd, lambda: future.done() or future.set_result(None))
+        except NotImplementedError:
+            await asyncio.sleep(0.05)
+            return
+        try:
+            # 退出状态到达时fileno不一定可读, 所以设置超时后重新检查
+            await asyncio.wait_for(future, 0.5)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            loop.remove_reader(fd)
+
+
+def run_remote_backups(backups, global_limit=None, host_limit=None):
+    '''使用asyncio并发执行多个RemoteBackup中所有数据库的备份, 返回JobResult列表
+
+    backups中的每个RemoteBackup需要已经设置远程服务器并通过prepare_backup检查.
+    '''
+
+    async def run(engine, backup, db):
+        start = time.time()
+        try:
+            result = await backup.async_single_db_backup(engine, db)
+        except Exception as e:
+            logger.error(e)
+            return JobResult(name=f"{backup.host}/{db}", status=False, elapsed=time.time() - start, result=e)
+        return JobResult(name=f"{backup.host}/{db}", status=result.status, elapsed=time.time() - start, result=result)
+
+    async def main():
+        engine = AsyncRemoteEngine(global_limit, host_limit)
+        return await asyncio.gather(*[run(engine, backup, db) for backup in backups for db in backup.dbs])
+
+    return asyncio.run(main())
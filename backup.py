@@ -1,16 +1,43 @@
 import os
-import getpass
+import json
+import sqlite3
+import time
+import datetime
+import shutil
 from collections import namedtuple
+import contextlib
 import abc
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from remote import RemoteServer
+from transfer import SftpDownloader
+from async_remote import run_remote_backups
 from core import get_logger
-from utils.common import exec_command
+from utils.declare import Status
+from utils.common import get_local_pgpass_file
+from utils.runner import run_pipeline, iter_file, fsync_path, FileSink, BufferSink, HashSink
+from utils.jobs import WorkerBudget, StepTimer, run_jobs, log_summary
+from utils.pg import ExportedSnapshot
+from utils.compress import CompressSink, CODEC_SUFFIX, iter_decompress
+from utils.checksum import write_sidecar
+from utils.metrics import JobMetrics
+from dedup import ChunkStore, DedupSink
+from catalog import get_catalog
 import settings
 
 logger = get_logger()
 Pgpass = namedtuple("Pgpass", ["host", "port", "db", "user", "password"])
+ARCHIVE_SUFFIX = (".dir", ".dump")
+# 单表备份的操作: (pg_dump选项, 文件后缀)
+TABLE_OPTIONS = {"data": ("-a", "_data.sql"), "struct": ("-s", "_struct.sql"), "all": (None, ".sql")}
+# 按表备份数据时, 不属于任何表的序列的备份文件
+SEQUENCES_FILE = "_sequences_data.sql"
+
+
+def regclass(table):
+    '''将表名转换为regclass字面量'''
+    name = table.replace("'", "''")
+    return f"'{name}'::regclass"
 
 
 class DbBackup(metaclass=abc.ABCMeta):
@@ -20,6 +47,45 @@ class DbBackup(metaclass=abc.ABCMeta):
         self._dbs = dbs
         self._bk_path = f"{bk_path.strip('/')}/{host}"
 
+    @property
+    def host(self):
+        return self._host
+
+    @property
+    def dbs(self):
+        return self._dbs
+
+    def catalog_record(self, db_name, mode, status, started, **fields):
+        '''将备份结果写入备份目录(catalog), 写入失败不影响备份本身'''
+        try:
+            get_catalog().record(self._host, db_name, mode, status, started, **fields)
+        except sqlite3.Error as e:
+            logger.error(f"写入备份目录失败: {e}")
+
+    @staticmethod
+    def save_checksum(path, hasher, result, scope="content"):
+        '''备份成功后将写入时计算的摘要保存到旁路文件, 返回"算法:摘要", 失败时返回None'''
+        if not result.status:
+            return None
+        return write_sidecar(path, hasher.algorithm, hasher.hexdigest(), hasher.bytes, scope)
+
+    @staticmethod
+    def replace_part(path, result):
+        '''备份先写入{path}.part, 成功后替换path, 失败时删除临时文件, 不破坏上一次成功的备份'''
+        part = f"{path}.part"
+        if result.status:
+            os.replace(part, path)
+        elif os.path.exists(part):
+            os.remove(part)
+
+    @staticmethod
+    def finish_metrics(metrics, result, path=None, sink=None, **fields):
+        '''BK_FSYNC为True时先将备份成功的文件刷到磁盘, 再导出任务的指标'''
+        if settings.BK_FSYNC and result.status and path:
+            with metrics.phase("fsync"):
+                fsync_path(path)
+        metrics.finish(result, sink, **fields)
+
     @abc.abstractmethod
     def make_bkdir(self):
         pass
@@ -36,6 +102,8 @@ class DbBackup(metaclass=abc.ABCMeta):
 class LocalBackup(DbBackup):
     def __init__(self, host="127.0.0.1", port=5432, dbs=None, bk_path="."):
         super().__init__(host, port, dbs, bk_path)
+        self._pg_version = None
+        self._pg_version_num = None
         self.make_bkdir()
 
     def make_bkdir(self):
@@ -45,8 +113,7 @@ class LocalBackup(DbBackup):
 
     def check_pgpass(self):
         '''检查需要备份的数据库是否配置到pgpass文件'''
-        user = getpass.getuser()
-        file = f"C:/Users/{user}/AppData/Roaming/postgresql/pgpass.conf"
+        file = get_local_pgpass_file()
         if not os.path.exists(file):
             logger.error(f"文件[{file}]不存在!")
             return False
@@ -66,25 +133,334 @@ class LocalBackup(DbBackup):
         results = [db in dbs for db in self._dbs]
         return all(results)
 
-    def single_db_backup(self, db_name):
-        '''备份单个数据库'''
-        cmd = f"pg_dump -h {self._host} -p {self._port} -U postgres -c {db_name} | gzip > {self._bk_path}/{db_name}.gz"
+    def _pg_command(self, program, *args):
+        '''生成连接到备份主机的pg命令参数'''
+        return [program, "-h", self._host, "-p", str(self._port), "-U", "postgres", *args]
+
+    def query(self, db, sql, snapshot=None):
+        '''通过psql执行查询, 返回行列表, 失败时返回None, snapshot不为空时在该导出快照中查询'''
+        buffer = BufferSink()
+        args = ["-X", "-q", "-A", "-t", "-F", "\t", "-v", "ON_ERROR_STOP=1"]
+        if snapshot:
+            args += ["-c", "BEGIN ISOLATION LEVEL REPEATABLE READ READ ONLY",
+                     "-c", f"SET TRANSACTION SNAPSHOT '{snapshot}'", "-c", sql, "-c", "COMMIT"]
+        else:
+            args += ["-c", sql]
+        cmd = self._pg_command("psql", *args, db)
+        result = run_pipeline([cmd], sinks=[buffer])
+        if not result.status:
+            logger.error(result.msg)
+            return None
+        text = buffer.getvalue().decode("utf-8", errors="replace")
+        return [line.split("\t") for line in text.splitlines() if line]
+
+    def get_pg_version(self, db):
+        '''查询备份主机的数据库版本, 同一个实例只查询一次'''
+        if self._pg_version is None:
+            rows = self.query(db, "show server_version")
+            self._pg_version = rows[0][0] if rows else ""
+        return self._pg_version or None
+
+    def get_pg_version_num(self, db):
+        '''查询备份主机的数据库版本号(server_version_num), 同一个实例只查询一次, 失败时返回0'''
+        if self._pg_version_num is None:
+            rows = self.query(db, "show server_version_num")
+            self._pg_version_num = int(rows[0][0]) if rows else 0
+        return self._pg_version_num
+
+    def count_rows(self, db, tables=None, snapshot=None):
+        '''统计表的行数, tables为空时使用BK_ROW_COUNT_TABLES, 仍为空时统计所有用户表, 失败时返回None'''
+        tables = tables or settings.BK_ROW_COUNT_TABLES or sorted(self.get_table_sizes(db))
+        if not tables:
+            return {}
+        sql = " union all ".join(f"select '{table.replace(chr(39), chr(39) * 2)}', count(*) from {table}"
+                                 for table in tables)
+        rows = self.query(db, sql, snapshot)
+        if rows is None:
+            return None
+        return {name: int(count) for name, count in rows}
+
+    @contextlib.contextmanager
+    def dump_snapshot(self, db_name):
+        '''BK_ROW_COUNTS为True时导出快照并返回快照id, 备份和行数统计使用同一个快照, 否则返回None'''
+        if not settings.BK_ROW_COUNTS:
+            yield None
+            return
+        with ExportedSnapshot(self._pg_command("psql", db_name)) as snapshot:
+            yield snapshot.snapshot_id
+
+    def get_db_sizes(self):
+        '''查询需要备份的数据库大小(pg_database_size)'''
+        # GUI中的dbs是set, 不能按下标取值
+        rows = self.query(next(iter(self._dbs)), "select datname, pg_database_size(datname) from pg_database")
+        if rows is None:
+            return {}
+        return {name: int(size) for name, size in rows if name in self._dbs}
+
+    def get_table_sizes(self, db):
+        '''查询数据库中所有用户表的大小(pg_relation_size)'''
+        sql = "select quote_ident(schemaname) || '.' || quote_ident(relname), pg_relation_size(relid) " \
+              "from pg_stat_user_tables"
+        rows = self.query(db, sql)
+        if rows is None:
+            return {}
+        return {name: int(size) for name, size in rows}
+
+    def single_db_backup(self, db_name, budget=None, codec=None, level=None):
+        '''备份单个数据库, codec/level可以为每个任务单独指定压缩算法和级别'''
+        if settings.BK_FORMAT == "directory":
+            return self.directory_db_backup(db_name, budget)
+        if settings.BK_FORMAT == "dedup":
+            return self.dedup_db_backup(db_name)
+
+        codec = codec or settings.BK_COMPRESS_CODEC
+        level = settings.BK_COMPRESS_LEVEL if level is None else level
+        file = f"{self._bk_path}/{self.full_backup_name(db_name)}{CODEC_SUFFIX[codec]}"
+        sink = CompressSink(f"{file}.part", codec, level)
         logger.info(f"备份数据库[{db_name}]开始, 请等待完成...")
-        result = exec_command(cmd)
+        hasher, metrics = HashSink(), JobMetrics(self._host, db_name, "full")
+        started = datetime.datetime.now()
+        with self.dump_snapshot(db_name) as snapshot:
+            result = run_pipeline([self._pg_command("pg_dump", "-c", "--if-exists", *self._snapshot_args(snapshot), db_name)],
+                                  sinks=[sink, hasher, metrics])
+            row_counts = self.count_rows(db_name, snapshot=snapshot) if snapshot and result.status else None
+        self.replace_part(file, result)
+        if not result.status:
+            logger.error(result.msg)
+        else:
+            logger.info(f"备份数据库[{db_name}]成功, 原始大小:{sink.bytes_in}字节, 压缩后:{sink.bytes_out}字节, "
+                        f"压缩比:{sink.ratio:.2f}, 压缩速度:{sink.speed:.1f}MB/s, 耗时:{result.elapsed:.1f}秒.")
+        self.finish_metrics(metrics, result, file, sink)
+        checksum = self.save_checksum(file, hasher, result)
+        self.catalog_record(db_name, "full", result.status, started, fmt=codec, bytes=sink.bytes_in,
+                            compressed_bytes=sink.bytes_out, checksum=checksum,
+                            pg_version=self.get_pg_version(db_name), path=file, row_counts=row_counts)
+        return result
+
+    @staticmethod
+    def full_backup_name(db_name):
+        '''完整备份的文件名(不含后缀), BK_KEEP_HISTORY为True时带上备份时间, 不覆盖之前的备份'''
+        if settings.BK_KEEP_HISTORY:
+            return f"{db_name}_{datetime.datetime.now():%Y%m%d%H%M%S}"
+        return db_name
+
+    @staticmethod
+    def _snapshot_args(snapshot):
+        return [f"--snapshot={snapshot}"] if snapshot else []
+
+    def dedup_store(self, path=None):
+        return ChunkStore(settings.DEDUP_PATH or os.path.join(path or self._bk_path, "dedup"))
+
+    def dedup_db_backup(self, db_name):
+        '''备份单个数据库到去重仓库, 只有与已有备份不同的块会被压缩保存'''
+        sink = DedupSink(self.dedup_store(), self._host, db_name)
+        logger.info(f"备份数据库[{db_name}]开始(去重), 请等待完成...")
+        hasher, metrics = HashSink(), JobMetrics(self._host, db_name, "full")
+        started = datetime.datetime.now()
+        with self.dump_snapshot(db_name) as snapshot:
+            result = run_pipeline([self._pg_command("pg_dump", "-c", "--if-exists", *self._snapshot_args(snapshot), db_name)],
+                                  sinks=[sink, hasher, metrics])
+            row_counts = self.count_rows(db_name, snapshot=snapshot) if snapshot and result.status else None
         if not result.status:
             logger.error(result.msg)
         else:
-            logger.info(f"备份数据库[{db_name}]成功.")
+            sink.commit()
+            logger.info(f"备份数据库[{db_name}]成功, 原始大小:{sink.bytes_in}字节, 共{sink.chunks}个块, "
+                        f"新增{sink.new_chunks}个块, 新增存储:{sink.bytes_stored}字节, 清单:{sink.manifest_file}, "
+                        f"耗时:{result.elapsed:.1f}秒.")
+        self.finish_metrics(metrics, result, sink.manifest_file, sink, bytes_out=sink.bytes_stored)
+        checksum = self.save_checksum(sink.manifest_file, hasher, result)
+        self.catalog_record(db_name, "full", result.status, started, fmt="dedup", bytes=sink.bytes_in,
+                            compressed_bytes=sink.bytes_stored, checksum=checksum,
+                            pg_version=self.get_pg_version(db_name), path=sink.manifest_file, row_counts=row_counts)
+        return result
+
+    def directory_db_backup(self, db_name, budget=None):
+        '''以目录格式并发备份单个数据库(pg_dump -Fd -j), budget用于在同时运行的数据库间分配并发数'''
+        path = f"{self._bk_path}/{self.full_backup_name(db_name)}.dir"
+        tmp_path = f"{path}.tmp"
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+
+        jobs = budget.acquire() if budget else settings.BK_DUMP_JOBS
+        started, metrics = datetime.datetime.now(), JobMetrics(self._host, db_name, "full")
+        try:
+            logger.info(f"备份数据库[{db_name}]开始(目录格式, 并发数:{jobs}), 请等待完成...")
+            with self.dump_snapshot(db_name) as snapshot:
+                cmd = self._pg_command("pg_dump", "-Fd", "-j", str(jobs), *self._snapshot_args(snapshot),
+                                       "-f", tmp_path, db_name)
+                result = run_pipeline([cmd])
+                row_counts = self.count_rows(db_name, snapshot=snapshot) if snapshot and result.status else None
+        finally:
+            if budget:
+                budget.release(jobs)
+
+        if not result.status:
+            logger.error(result.msg)
+            self.finish_metrics(metrics, result)
+            self.catalog_record(db_name, "full", False, started, fmt="directory")
+            return result
+
+        # 备份成功后才替换上一次的备份
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.rename(tmp_path, path)
+        logger.info(f"备份数据库[{db_name}]成功, 耗时:{result.elapsed:.1f}秒.")
+        size = sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+        self.finish_metrics(metrics, result, path, bytes_in=size, bytes_out=size)
+        self.catalog_record(db_name, "full", True, started, fmt="directory", compressed_bytes=size,
+                            pg_version=self.get_pg_version(db_name), path=path, row_counts=row_counts)
+        return result
 
     def single_db_data_backup(self, db_name):
         '''备份单个数据库中的数据'''
-        cmd = f"pg_dump -h {self._host} -p {self._port} -U postgres -a {db_name} > {self._bk_path}/{db_name}_data.sql"
+        if settings.BK_DATA_SPLIT_TABLES:
+            if not self.has_large_objects(db_name):
+                return self.tables_data_backup(db_name)
+            logger.warning(f"数据库[{db_name}]中有大对象, 按表备份不包含大对象, 改为整库备份数据.")
+
+        cmd = self._pg_command("pg_dump", "-a", db_name)
+        file = f"{self._bk_path}/{db_name}_data.sql"
         logger.info(f"备份数据库[{db_name}]数据开始, 请等待完成...")
-        result = exec_command(cmd)
+        sink, hasher, metrics = FileSink(f"{file}.part"), HashSink(), JobMetrics(self._host, db_name, "data")
+        started = datetime.datetime.now()
+        result = run_pipeline([cmd], sinks=[sink, hasher, metrics])
+        self.replace_part(file, result)
         if not result.status:
             logger.error(result.msg)
         else:
-            logger.info(f"备份数据库[{db_name}]数据成功.")
+            logger.info(f"备份数据库[{db_name}]数据成功, 大小:{result.bytes}字节, 耗时:{result.elapsed:.1f}秒.")
+        self.finish_metrics(metrics, result, file, sink)
+        self.catalog_record(db_name, "data", result.status, started, fmt="sql", bytes=result.bytes,
+                            checksum=self.save_checksum(file, hasher, result), pg_version=self.get_pg_version(db_name),
+                            path=file)
+        return result
+
+    def get_table_stats(self, db):
+        '''查询数据库中所有用户表的变更计数器和大小, 用于判断表是否变化, 失败时返回None'''
+        sql = "select quote_ident(schemaname) || '.' || quote_ident(relname), n_tup_ins, n_tup_upd, n_tup_del, " \
+              "pg_relation_size(relid), pg_relation_filenode(relid) from pg_stat_user_tables"
+        rows = self.query(db, sql)
+        if rows is None:
+            return None
+        fields = ("n_tup_ins", "n_tup_upd", "n_tup_del", "size", "filenode")
+        return {row[0]: dict(zip(fields, (int(value or 0) for value in row[1:]))) for row in rows}
+
+    def get_standalone_sequences(self, db):
+        '''查询不属于任何表的序列(没有OWNED BY, 不是identity列), 属于表的序列随表一起备份, 失败时返回None'''
+        sql = "select quote_ident(n.nspname) || '.' || quote_ident(c.relname) from pg_class c " \
+              "join pg_namespace n on n.oid = c.relnamespace " \
+              "where c.relkind = 'S' and n.nspname not in ('pg_catalog', 'information_schema') " \
+              "and n.nspname not like 'pg\\_%' and not exists (select 1 from pg_depend d " \
+              "where d.classid = 'pg_class'::regclass and d.objid = c.oid and d.deptype in ('a', 'i', 'e'))"
+        rows = self.query(db, sql)
+        if rows is None:
+            return None
+        return sorted(row[0] for row in rows)
+
+    def has_large_objects(self, db):
+        '''数据库中是否有大对象, 查询失败时按有大对象处理'''
+        rows = self.query(db, "select exists (select 1 from pg_largeobject_metadata)")
+        return not rows or rows[0][0] == "t"
+
+    def tables_data_backup(self, db_name):
+        '''按表并发备份单个数据库的数据
+
+        所有表在同一个导出的快照下备份, 保证数据一致,
+        每个表输出到{db}_data目录下的单独文件, 并生成manifest.json.
+        BK_DATA_INCREMENTAL为True时, 与上一次manifest中记录的pg_stat_user_tables计数器、
+        大小和filenode都相同的表不再备份, 清单中直接引用上一次的文件.
+        pg_stat_user_tables中只有表, 不属于任何表的序列在同一个快照下单独备份到SEQUENCES_FILE,
+        每次都重新备份. 按表备份不包含大对象, 有大对象的数据库由single_db_data_backup改为整库备份.
+        '''
+        # 查询失败时不能当作没有表, 否则会生成空的备份并覆盖上一次的清单
+        stats = self.get_table_stats(db_name)
+        if stats is None:
+            logger.error(f"查询数据库[{db_name}]的表失败")
+            return False
+        sequences = self.get_standalone_sequences(db_name)
+        if sequences is None:
+            logger.error(f"查询数据库[{db_name}]的序列失败")
+            return False
+        out_dir = f"{self._bk_path}/{db_name}_data"
+        os.makedirs(out_dir, exist_ok=True)
+
+        reused = {}
+        if settings.BK_DATA_INCREMENTAL:
+            for entry in self._load_manifest(out_dir).get("tables", []):
+                table = entry["table"]
+                if entry["status"] and entry.get("stats") == stats.get(table) \
+                        and os.path.exists(f"{out_dir}/{entry['file']}"):
+                    reused[table] = dict(entry, reused=True)
+        sizes = {table: stat["size"] for table, stat in stats.items() if table not in reused}
+        logger.info(f"按表备份数据库[{db_name}]数据开始, 共{len(stats)}个表, 需要备份{len(sizes)}个, "
+                    f"未变化{len(reused)}个, 请等待完成...")
+
+        started = datetime.datetime.now()
+        with ExportedSnapshot(self._pg_command("psql", db_name)) as snapshot:
+            results = run_jobs(self._table_data_job, sizes, settings.BK_TABLE_THREAD_NUM, sizes,
+                               args=(db_name, out_dir, snapshot.snapshot_id))
+            seq_result = self.sequences_dump(db_name, sequences, f"{out_dir}/{SEQUENCES_FILE}",
+                                             snapshot.snapshot_id) if sequences else None
+
+        tables = list(reused.values()) + [{
+            "table": result.name,
+            "file": self.table_file_name(result.name, "data"),
+            "bytes": getattr(result.result, "bytes", 0),
+            "status": result.status,
+            "elapsed": round(result.elapsed, 3),
+            "snapshot": snapshot.snapshot_id,
+            "stats": stats[result.name],
+            "reused": False,
+        } for result in results]
+        manifest = {
+            "host": self._host,
+            "port": self._port,
+            "db": db_name,
+            "snapshot": snapshot.snapshot_id,
+            "started": started.isoformat(),
+            "finished": datetime.datetime.now().isoformat(),
+            "tables": sorted(tables, key=lambda entry: entry["table"]),
+            "sequences": {
+                "names": sequences,
+                "file": SEQUENCES_FILE if seq_result else None,
+                "bytes": seq_result.bytes if seq_result else 0,
+                "status": bool(seq_result.status) if seq_result else True,
+            },
+        }
+        with open(f"{out_dir}/manifest.json", "w") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+        failed = [result.name for result in results if not result.status]
+        if seq_result is not None and not seq_result.status:
+            failed.append(SEQUENCES_FILE)
+        artifacts = [f"{out_dir}/manifest.json"] + [f"{out_dir}/{entry['file']}" for entry in tables]
+        if seq_result is not None:
+            artifacts.append(f"{out_dir}/{SEQUENCES_FILE}")
+        self.catalog_record(db_name, "data", not failed, started, fmt="tables",
+                            bytes=sum(entry["bytes"] for entry in tables) + manifest["sequences"]["bytes"],
+                            pg_version=self.get_pg_version(db_name), path=f"{out_dir}/manifest.json",
+                            artifacts=artifacts)
+        if failed:
+            logger.error(f"按表备份数据库[{db_name}]数据失败, 失败的表:{failed}")
+            return False
+        logger.info(f"按表备份数据库[{db_name}]数据成功, 清单文件:{out_dir}/manifest.json")
+        return True
+
+    @staticmethod
+    def _load_manifest(path):
+        '''读取目录中的manifest.json, 不存在或损坏时返回空字典'''
+        file = f"{path}/manifest.json"
+        if not os.path.exists(file):
+            return {}
+        try:
+            with open(file, "r") as f:
+                return json.load(f)
+        except ValueError:
+            return {}
+
+    def _table_data_job(self, table, db_name, out_dir, snapshot):
+        return self.table_dump(db_name, table, "data", f"{out_dir}/{self.table_file_name(table, 'data')}", snapshot)
 
     def db_backup(self):
         '''数据库备份'''
@@ -98,12 +474,10 @@ class LocalBackup(DbBackup):
             return
 
         logger.info(f"开始进行数据库{self._dbs}备份, 请等到完成...")
-        with ThreadPoolExecutor(max_workers=settings.BK_THREAD_NUM) as executor:
-            tasks = [executor.submit(self.single_db_backup, db) for db in self._dbs]
-            for task in as_completed(tasks):
-                exception = task.exception()
-                if exception:
-                    logger.error(exception)
+        budget = WorkerBudget(settings.BK_DUMP_JOBS, len(self._dbs), settings.BK_THREAD_NUM)
+        results = run_jobs(self.single_db_backup, self._dbs, settings.BK_THREAD_NUM, self.get_db_sizes(),
+                           args=(budget,))
+        log_summary(results, "数据库备份")
         logger.info("数据库备份已全部完毕.")
 
     def db_restore(self, path):
@@ -123,12 +497,124 @@ class LocalBackup(DbBackup):
             return False
 
         logger.info(f"开始进行数据库{self._dbs}恢复, 请等到完成...")
-        for loop in self._dbs:
-            cmd = f"cat {path}/{loop}.gz | gunzip | psql -p {self._port} -h {self._host} -U postgres {loop}"
-            result = exec_command(cmd)
-            if not result.status:
-                logger.error(result.msg)
-        logger.info("数据库恢复完成.")
+        start = time.time()
+        budget = WorkerBudget(settings.RS_MAX_JOBS, len(self._dbs), settings.RS_THREAD_NUM)
+        results = run_jobs(lambda db: self.single_db_restore(path, db, budget), self._dbs, settings.RS_THREAD_NUM)
+        log_summary(results, "数据库恢复")
+        logger.info(f"数据库恢复完成, 总耗时:{time.time() - start:.1f}秒.")
+
+    def single_db_restore(self, path, db_name, budget=None):
+        '''恢复单个数据库, 自定义/目录格式的备份使用pg_restore并发恢复'''
+        return self.restore_artifact(self.find_artifact(path, db_name), db_name, budget)
+
+    def restore_artifact(self, file, db_name, budget=None, timer=None, stop_on_error=False):
+        '''将备份文件恢复到db_name, timer不为空时记录每个步骤的耗时
+
+        psql默认在SQL出错后继续执行并以0退出, stop_on_error为True时使用ON_ERROR_STOP,
+        任何一条语句出错都会使恢复失败. 完整备份使用pg_dump -c --if-exists, 恢复到空数据库时DROP不会出错.
+        '''
+        if file.endswith(ARCHIVE_SUFFIX):
+            return self.archive_db_restore(file, db_name, budget, timer)
+
+        if file.endswith(".json"):
+            source = ChunkStore.for_manifest(file).iter_restore(file)
+        else:
+            source = iter_decompress(file)
+        logger.info(f"恢复数据库[{db_name}]开始, 请等待完成...")
+        with timer.step("restore") if timer else contextlib.nullcontext():
+            args = ["-v", "ON_ERROR_STOP=1"] if stop_on_error else []
+            result = run_pipeline([self._pg_command("psql", *args, db_name)], source=source)
+        if not result.status:
+            logger.error(result.msg)
+        else:
+            if result.msg:
+                logger.warning(result.msg)
+            logger.info(f"恢复数据库[{db_name}]完成, 耗时:{result.elapsed:.1f}秒.")
+        return result
+
+    def archive_db_restore(self, archive, db_name, budget=None, timer=None):
+        '''使用pg_restore -j恢复自定义/目录格式的备份
+
+        先重建数据库, 再按pre-data/data/post-data分步恢复并记录每一步的耗时,
+        post-data中的索引和约束也会并发创建.
+        '''
+        timer, usage = timer or StepTimer(), []
+        jobs = budget.acquire() if budget else settings.RS_MAX_JOBS
+        logger.info(f"恢复数据库[{db_name}]开始(并发数:{jobs}), 请等待完成...")
+        try:
+            steps = [
+                ("dropdb", self._pg_command("dropdb", "--if-exists", db_name)),
+                ("createdb", self._pg_command("createdb", db_name)),
+            ]
+            for section in ("pre-data", "data", "post-data"):
+                cmd = self._pg_command("pg_restore", "-d", db_name, f"--section={section}", "-j", str(jobs), archive)
+                steps.append((section, cmd))
+
+            for name, cmd in steps:
+                with timer.step(name):
+                    result = run_pipeline([cmd])
+                usage.extend(result.usage)
+                if not result.status:
+                    logger.error(f"恢复数据库[{db_name}]在[{name}]步骤失败: {result.msg}")
+                    break
+        finally:
+            if budget:
+                budget.release(jobs)
+
+        if result.status:
+            logger.info(f"恢复数据库[{db_name}]完成, 总耗时:{timer.total:.1f}秒, 各步骤耗时: {timer.summary()}")
+        # 各步骤的命令都计入资源使用
+        return result._replace(usage=tuple(usage))
+
+    def restore_test(self, db_name, path=None):
+        '''恢复测试: 将数据库最新的备份恢复到临时数据库, 与备份时记录的行数比较后删除临时数据库
+
+        path为空时使用备份目录(catalog)中该数据库最新的备份, 否则使用path目录中的备份.
+        恢复时psql使用ON_ERROR_STOP, 任何一条语句出错都算作失败.
+        每个步骤的耗时记录到备份目录, 用于跟踪实际的恢复时间(RTO). 返回Status.
+        '''
+        record = get_catalog().latest(db_name, host=self._host, path=path)
+        file = record["path"] if record else self.find_artifact(path, db_name) if path else None
+        if not file or not os.path.exists(file):
+            msg = f"没有找到数据库[{db_name}]可用的备份"
+            logger.error(msg)
+            return Status(status=False, msg=msg)
+
+        scratch = f"{db_name}_restore_test_{datetime.datetime.now():%Y%m%d%H%M%S}"
+        expected = record.get("row_counts") if record else None
+        timer, mismatches = StepTimer(), {}
+        started = datetime.datetime.now()
+        logger.info(f"恢复测试[{file}]开始, 临时数据库:{scratch}, 请等待完成...")
+        try:
+            if not file.endswith(ARCHIVE_SUFFIX):
+                with timer.step("createdb"):
+                    result = run_pipeline([self._pg_command("createdb", scratch)])
+            if file.endswith(ARCHIVE_SUFFIX) or result.status:
+                result = self.restore_artifact(file, scratch, timer=timer, stop_on_error=True)
+            if result.status and expected:
+                with timer.step("verify"):
+                    counts = self.count_rows(scratch, list(expected)) or {}
+                mismatches = {table: {"expected": count, "actual": counts.get(table)}
+                              for table, count in expected.items() if counts.get(table) != count}
+        finally:
+            with timer.step("dropdb"):
+                run_pipeline([self._pg_command("dropdb", "--if-exists", scratch)])
+
+        status = result.status and not mismatches
+        get_catalog().record_restore_test(record["id"] if record else None, self._host, db_name, scratch, status,
+                                          started, {name: round(elapsed, 3) for name, elapsed in timer.steps},
+                                          mismatches)
+        if not result.status:
+            msg = f"恢复测试[{file}]失败: {result.msg}"
+            logger.error(msg)
+        elif mismatches:
+            msg = f"恢复测试[{file}]行数不一致: {mismatches}"
+            logger.error(msg)
+        else:
+            verified = f"{len(expected)}个表的行数一致" if expected else "备份时没有记录行数, 未比较"
+            msg = f"恢复测试[{file}]成功, {verified}, 总耗时:{timer.total:.1f}秒, 各步骤耗时: {timer.summary()}"
+            logger.info(msg)
+        return Status(status=status, msg=msg)
 
     def restore_check(self, path):
         '''数据库恢复检查'''
@@ -137,12 +623,27 @@ class LocalBackup(DbBackup):
             return False
 
         for db in self._dbs:
-            file = os.path.join(path, f"{db}.gz")
-            if not os.path.exists(file):
-                logger.error(f"文件:{file}不存在!")
+            if not self.find_artifact(path, db):
+                suffixes = list(ARCHIVE_SUFFIX) + list(CODEC_SUFFIX.values())
+                logger.error(f"文件:{os.path.join(path, db)}{suffixes}不存在!")
                 return False
         return True
 
+    def find_artifact(self, path, db):
+        '''查找数据库的备份文件
+
+        优先使用备份目录(catalog)中记录的该目录下最新的成功备份,
+        没有记录时优先使用可以并发恢复的自定义/目录格式, 最后使用去重仓库中最新的清单.
+        '''
+        record = get_catalog().latest(db, path=path)
+        if record and os.path.exists(record["path"]):
+            return record["path"]
+        for suffix in ARCHIVE_SUFFIX + tuple(CODEC_SUFFIX.values()):
+            file = os.path.join(path, f"{db}{suffix}")
+            if os.path.exists(file):
+                return file
+        return self.dedup_store(path).latest_manifest(self._host, db)
+
     def table_data_backup(self):
         '''表数据备份'''
         if not self._dbs:
@@ -155,12 +656,8 @@ class LocalBackup(DbBackup):
             return
 
         logger.info(f"开始进行数据库{self._dbs}表数据备份, 请等待完成...")
-        with ThreadPoolExecutor(max_workers=settings.BK_THREAD_NUM) as executor:
-            tasks = [executor.submit(self.single_db_data_backup, db) for db in self._dbs]
-            for task in as_completed(tasks):
-                exception = task.exception()
-                if exception:
-                    logger.error(exception)
+        results = run_jobs(self.single_db_data_backup, self._dbs, settings.BK_THREAD_NUM, self.get_db_sizes())
+        log_summary(results, "数据备份")
         logger.info("数据库数据备份已完成.")
 
     def table_struct_backup(self):
@@ -175,15 +672,28 @@ class LocalBackup(DbBackup):
             return
 
         logger.info(f"开始进行数据库[{self._dbs}]表结构备份, 请等待完成...")
-        for loop in self._dbs:
-            cmd = f"pg_dump -p {self._port} -h {self._host} -U postgres -s {loop} > {self._bk_path}/{loop}_struct.sql"
-            result = exec_command(cmd)
-            if not result.status:
-                logger.error(result.msg)
-            else:
-                logger.info(f"备份数据库[{loop}]表结构成功.")
+        results = run_jobs(self.single_db_struct_backup, self._dbs, settings.STRUCT_THREAD_NUM)
+        log_summary(results, "表结构备份")
         logger.info("备份数据库表结构已完成")
 
+    def single_db_struct_backup(self, db_name):
+        '''备份单个数据库的表结构'''
+        cmd = self._pg_command("pg_dump", "-s", db_name)
+        file = f"{self._bk_path}/{db_name}_struct.sql"
+        sink, hasher, metrics = FileSink(f"{file}.part"), HashSink(), JobMetrics(self._host, db_name, "struct")
+        started = datetime.datetime.now()
+        result = run_pipeline([cmd], sinks=[sink, hasher, metrics])
+        self.replace_part(file, result)
+        if not result.status:
+            logger.error(result.msg)
+        else:
+            logger.info(f"备份数据库[{db_name}]表结构成功.")
+        self.finish_metrics(metrics, result, file, sink)
+        self.catalog_record(db_name, "struct", result.status, started, fmt="sql", bytes=result.bytes,
+                            checksum=self.save_checksum(file, hasher, result), pg_version=self.get_pg_version(db_name),
+                            path=file)
+        return result
+
     def single_table_backup(self, db, table, operation):
         '''单表备份'''
         if not db:
@@ -203,22 +713,173 @@ class LocalBackup(DbBackup):
             logger.error("请检查pgpass文件, 确保需要备份的数据库已配置到了pgpass文件")
             return
 
-        logger.info(f"开始进行数据库[{db}]的[{table}]表备份, 请等待完成...")
-        if operation == "data":
-            cmd = f"pg_dump -p {self._port} -h {self._host} -U postgres -t {table} -a {db}> {self._bk_path}/{table}_data.sql"
-        elif operation == "struct":
-            cmd = f"pg_dump -p {self._port} -h {self._host} -U postgres -t {table} -s {db}> {self._bk_path}/{table}_struct.sql"
-        elif operation == "all":
-            cmd = f"pg_dump -p {self._port} -h {self._host} -U postgres -t {table} {db}> {self._bk_path}/{table}.sql"
-        else:
+        if operation not in TABLE_OPTIONS:
             logger.error(f"不支持的操作:{operation}")
             return
 
-        result = exec_command(cmd)
+        logger.info(f"开始进行数据库[{db}]的[{table}]表备份, 请等待完成...")
+        if operation == "data" and self.get_table_size(db, table) >= settings.BK_TABLE_SPLIT_SIZE:
+            return self.table_parts_backup(db, table)
+        return self.table_dump(db, table, operation, f"{self._bk_path}/{self.table_file_name(table, operation)}")
+
+    def get_table_size(self, db, table):
+        '''查询单个表的大小(pg_relation_size)'''
+        rows = self.query(db, f"select pg_relation_size({regclass(table)})")
+        return int(rows[0][0]) if rows else 0
+
+    def table_ranges(self, db, table, parts):
+        '''将表划分为parts个范围, 返回(划分方式, where条件列表)
+
+        BK_TABLE_SPLIT_BY为pk且表有单列整数主键时按主键值划分, 否则按ctid的页号划分.
+        第一个和最后一个范围不设边界, 以包含统计之后新增的行.
+        PostgreSQL 14之前没有TID Range Scan, 每个ctid范围都要扫描全表, 此时不划分, 返回(None, None).
+        '''
+        column, bounds = None, None
+        if settings.BK_TABLE_SPLIT_BY == "pk":
+            sql = "select quote_ident(a.attname) from pg_index i join pg_attribute a " \
+                  "on a.attrelid = i.indrelid and a.attnum = i.indkey[0] " \
+                  f"where i.indrelid = {regclass(table)} and i.indisprimary and i.indnatts = 1 " \
+                  "and a.atttypid in ('int2'::regtype, 'int4'::regtype, 'int8'::regtype)"
+            rows = self.query(db, sql)
+            if rows:
+                column = rows[0][0]
+                rows = self.query(db, f"select min({column}), max({column}) from {table}")
+                if rows and rows[0][0]:
+                    low, high = int(rows[0][0]), int(rows[0][1])
+                    bounds = [str(low + (high - low + 1) * index // parts) for index in range(1, parts)]
+
+        if bounds is None:
+            if self.get_pg_version_num(db) < 140000:
+                return None, None
+            column = "ctid"
+            rows = self.query(db, f"select pg_relation_size({regclass(table)}) / current_setting('block_size')::int")
+            pages = int(rows[0][0]) if rows else 0
+            bounds = [f"'({pages * index // parts},0)'::tid" for index in range(1, parts)]
+
+        conditions = []
+        for index in range(parts):
+            terms = []
+            if index > 0:
+                terms.append(f"{column} >= {bounds[index - 1]}")
+            if index < parts - 1:
+                terms.append(f"{column} < {bounds[index]}")
+            conditions.append(" and ".join(terms) or "true")
+        return ("ctid" if column == "ctid" else "pk"), conditions
+
+    def table_parts_backup(self, db, table):
+        '''将大表按范围划分为多个部分, 在同一个导出快照下并发COPY导出
+
+        每个部分写入{table}_data.parts目录下编号的文件, 并生成manifest.json.
+        '''
+        size = self.get_table_size(db, table)
+        parts = max(1, -(-size // settings.BK_TABLE_PART_SIZE))
+        split_by, conditions = self.table_ranges(db, table, parts)
+        if conditions is None:
+            logger.warning(f"数据库[{db}]的[{table}]无法按范围划分(没有整数主键且版本低于14), 改为单个pg_dump备份.")
+            return self.table_dump(db, table, "data", f"{self._bk_path}/{self.table_file_name(table, 'data')}")
+        out_dir = f"{self._bk_path}/{self.table_file_name(table, 'data')[:-4]}.parts"
+        os.makedirs(out_dir, exist_ok=True)
+        logger.info(f"按{split_by}范围备份数据库[{db}]的[{table}]开始, 共{parts}个部分, 请等待完成...")
+
+        with ExportedSnapshot(self._pg_command("psql", db)) as snapshot:
+            results = run_jobs(self._table_part_job, range(parts), settings.BK_TABLE_THREAD_NUM,
+                               args=(db, table, conditions, out_dir, snapshot.snapshot_id))
+
+        results = sorted(results, key=lambda result: result.name)
+        manifest = {
+            "db": db,
+            "table": table,
+            "split_by": split_by,
+            "snapshot": snapshot.snapshot_id,
+            "parts": [{
+                "file": f"part_{result.name + 1:04d}.copy",
+                "where": conditions[result.name],
+                "bytes": getattr(result.result, "bytes", 0),
+                "status": result.status,
+                "elapsed": round(result.elapsed, 3),
+            } for result in results],
+        }
+        with open(f"{out_dir}/manifest.json", "w") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+        failed = [result.name + 1 for result in results if not result.status]
+        if failed:
+            logger.error(f"备份数据库[{db}]的[{table}]失败, 失败的部分:{failed}")
+            return False
+        logger.info(f"备份数据库[{db}]的[{table}]成功, 清单文件:{out_dir}/manifest.json")
+        return True
+
+    def _table_part_job(self, index, db, table, conditions, out_dir, snapshot):
+        cmd = self._pg_command("psql", "-X", "-q", "-v", "ON_ERROR_STOP=1",
+                               "-c", "BEGIN ISOLATION LEVEL REPEATABLE READ READ ONLY",
+                               "-c", f"SET TRANSACTION SNAPSHOT '{snapshot}'",
+                               "-c", f"COPY (SELECT * FROM {table} WHERE {conditions[index]}) TO STDOUT",
+                               "-c", "COMMIT", db)
+        file, hasher = f"{out_dir}/part_{index + 1:04d}.copy", HashSink()
+        result = run_pipeline([cmd], sinks=[FileSink(file), hasher])
+        if not result.status:
+            logger.error(result.msg)
+        self.save_checksum(file, hasher, result)
+        return result
+
+    def table_parts_restore(self, path):
+        '''并发恢复table_parts_backup生成的各个部分, path为.parts目录'''
+        with open(os.path.join(path, "manifest.json"), "r") as f:
+            manifest = json.load(f)
+
+        logger.info(f"恢复数据库[{manifest['db']}]的[{manifest['table']}]开始, "
+                    f"共{len(manifest['parts'])}个部分, 请等待完成...")
+        results = run_jobs(self._table_part_restore_job, range(len(manifest["parts"])),
+                           settings.BK_TABLE_THREAD_NUM, args=(path, manifest))
+        failed = [result.name + 1 for result in results if not result.status]
+        if failed:
+            logger.error(f"恢复数据库[{manifest['db']}]的[{manifest['table']}]失败, 失败的部分:{failed}")
+            return False
+        logger.info(f"恢复数据库[{manifest['db']}]的[{manifest['table']}]成功.")
+        return True
+
+    def _table_part_restore_job(self, index, path, manifest):
+        file = os.path.join(path, manifest["parts"][index]["file"])
+        cmd = self._pg_command("psql", "-X", "-q", "-v", "ON_ERROR_STOP=1",
+                               "-c", f"COPY {manifest['table']} FROM STDIN", manifest["db"])
+        result = run_pipeline([cmd], source=iter_file(file))
+        if not result.status:
+            logger.error(result.msg)
+        return result
+
+    @staticmethod
+    def table_file_name(table, operation):
+        '''单表备份的文件名'''
+        name = table.replace('"', "")
+        return f"{name}{TABLE_OPTIONS[operation][1]}"
+
+    def sequences_dump(self, db, sequences, file, snapshot=None):
+        '''使用一个pg_dump -a备份多个序列的当前值'''
+        args = [arg for sequence in sequences for arg in ("-t", sequence)]
+        args += ["-a"] + ([f"--snapshot={snapshot}"] if snapshot else [])
+        hasher = HashSink()
+        result = run_pipeline([self._pg_command("pg_dump", *args, db)], sinks=[FileSink(f"{file}.part"), hasher])
+        self.replace_part(file, result)
+        if not result.status:
+            logger.error(result.msg)
+        else:
+            logger.info(f"备份数据库[{db}]的{len(sequences)}个序列成功.")
+        self.save_checksum(file, hasher, result)
+        return result
+
+    def table_dump(self, db, table, operation, file, snapshot=None):
+        '''使用pg_dump -t备份单个表, snapshot为共享的导出快照'''
+        option = TABLE_OPTIONS[operation][0]
+        args = ["-t", table] + ([option] if option else []) + ([f"--snapshot={snapshot}"] if snapshot else [])
+        hasher = HashSink()
+        result = run_pipeline([self._pg_command("pg_dump", *args, db)], sinks=[FileSink(f"{file}.part"), hasher])
+        self.replace_part(file, result)
         if not result.status:
             logger.error(result.msg)
         else:
             logger.info(f"备份数据库[{db}]的[{table}]成功.")
+        self.save_checksum(file, hasher, result)
+        return result
 
 
 class RemoteBackup(DbBackup):
@@ -264,34 +925,136 @@ class RemoteBackup(DbBackup):
         results = [db in dbs for db in self._dbs]
         return all(results)
 
+    def _dump_command(self, db_name, to_local=False):
+        '''远程备份命令
+
+        to_local为True时压缩后的数据输出到标准输出, 否则写入远程文件, 同时通过tee计算文件的sha256并输出.
+        '''
+        cmd = f"pg_dump -h {self._host} -p {self._port} -U postgres -c --if-exists {db_name} | gzip"
+        if not to_local:
+            cmd = f"{cmd} | tee {self._bk_path}/{db_name}.gz | sha256sum"
+        return f"bash -o pipefail -c '{cmd}'"
+
     def _single_db_backup(self, db_name):
         '''单个数据库备份'''
         logger.info(f"开始备份数据库[{db_name}], 请等待完成...")
-        cmd = f"pg_dump -h {self._host} -p {self._port} -U postgres -c {db_name} | gzip > {self._bk_path}/{db_name}.gz"
-        result = self._remote_server.exec_command(cmd)
+        buffer, metrics = BufferSink(), JobMetrics(self._host, db_name, "full")
+        result = self._remote_server.exec_stream(self._dump_command(db_name), sinks=[buffer, metrics])
+        return self._finish_db_backup(db_name, result, buffer, metrics)
+
+    def _finish_db_backup(self, db_name, result, buffer, metrics):
+        # 备份文件在远程服务器上, 标准输出只有sha256sum的结果, 不统计字节数
+        metrics.finish(result, bytes_in=0, bytes_out=0)
+        checksum = None
         if not result.status:
             logger.error(result.msg)
         else:
-            logger.info(f"数据库[{db_name}]备份完成.")
+            checksum = f"sha256:{buffer.getvalue().decode().split()[0]}"
+            logger.info(f"数据库[{db_name}]备份完成, 耗时:{result.elapsed:.1f}秒.")
+        # 备份文件在远程服务器上, 不记录本地路径
+        self.catalog_record(db_name, "full", result.status, time.time() - result.elapsed, fmt="remote",
+                            checksum=checksum)
+        return result
 
-    def db_backup(self):
-        '''数据库备份'''
+    def _single_db_stream_backup(self, db_name):
+        '''在远程执行pg_dump | gzip, 压缩后的数据通过SSH通道直接写入本地备份目录
+
+        每个数据库使用连接池中的一个通道, 通道窗口(SSH_WINDOW_SIZE)提供流量控制,
+        本地按块写入文件, 内存占用与数据库大小无关.
+        '''
+        logger.info(f"开始备份数据库[{db_name}]到本地, 请等待完成...")
+        file = f"{self._bk_path}/{db_name}.gz"
+        sink, hasher, metrics = FileSink(f"{file}.part"), HashSink(), JobMetrics(self._host, db_name, "full")
+        result = self._remote_server.exec_stream(self._dump_command(db_name, to_local=True),
+                                                 sinks=[sink, hasher, metrics])
+        return self._finish_db_stream_backup(db_name, result, file, sink, hasher, metrics)
+
+    def _finish_db_stream_backup(self, db_name, result, file, sink, hasher, metrics):
+        self.replace_part(file, result)
+        if not result.status:
+            logger.error(result.msg)
+        else:
+            speed = result.bytes / 1024 / 1024 / result.elapsed if result.elapsed else 0.0
+            logger.info(f"数据库[{db_name}]备份到本地完成, 大小:{result.bytes}字节, 耗时:{result.elapsed:.1f}秒, "
+                        f"速度:{speed:.1f}MB/s.")
+        self.finish_metrics(metrics, result, file, sink)
+        # 数据在远程已经压缩, 摘要是本地文件本身的内容
+        checksum = self.save_checksum(file, hasher, result, scope="file")
+        self.catalog_record(db_name, "full", result.status, time.time() - result.elapsed, fmt="gzip",
+                            compressed_bytes=result.bytes, checksum=checksum, path=file if result.status else None)
+        return result
+
+    async def async_single_db_backup(self, engine, db_name):
+        '''在AsyncRemoteEngine中备份单个数据库, 结果和日志与线程方式相同'''
+        # 所有任务同时提交给引擎, 取得执行名额后才打开文件和开始计时, 避免排队的任务占用文件描述符
+        sinks = []
+        if settings.RM_BK_TO_LOCAL:
+            file = f"{self._bk_path}/{db_name}.gz"
+
+            def open_sinks():
+                logger.info(f"开始备份数据库[{db_name}]到本地, 请等待完成...")
+                sinks.extend([FileSink(f"{file}.part"), HashSink(), JobMetrics(self._host, db_name, "full")])
+                return sinks
+
+            result = await engine.exec_stream(self._remote_server, self._dump_command(db_name, to_local=True),
+                                              open_sinks)
+            return self._finish_db_stream_backup(db_name, result, file, *sinks)
+
+        def open_buffer():
+            logger.info(f"开始备份数据库[{db_name}], 请等待完成...")
+            sinks.extend([BufferSink(), JobMetrics(self._host, db_name, "full")])
+            return sinks
+
+        result = await engine.exec_stream(self._remote_server, self._dump_command(db_name), open_buffer)
+        return self._finish_db_backup(db_name, result, *sinks)
+
+    def fetch_backups(self, local_path="."):
+        '''通过SFTP将远程备份目录中的备份文件下载到本地的local_path/host目录'''
+        if not self._remote_server:
+            logger.error("请先设置远程服务器!")
+            return False
+
+        local_dir = f"{local_path.strip('/')}/{self._host}"
+        os.makedirs(local_dir, exist_ok=True)
+        files = [(f"{self._bk_path}/{db}.gz", f"{local_dir}/{db}.gz") for db in self._dbs]
+        failed = SftpDownloader(self._remote_server).download_files(files)
+        return not failed
+
+    def prepare_backup(self):
+        '''备份前检查并创建备份目录'''
         if not self._dbs:
             logger.error("请选择需要进行表结构备份的数据库!")
-            return
+            return False
 
         if not self._remote_server:
             logger.error("请先设置远程服务器!")
-            return
+            return False
 
         if not self.check_pgpass():
             logger.error("请检查.pgpass文件, 确保需要备份的数据库都配置到了.pgpass文件!")
+            return False
+
+        if settings.RM_BK_TO_LOCAL:
+            # 备份文件直接写入本地的bk_path/host目录
+            os.makedirs(self._bk_path, exist_ok=True)
+        else:
+            self.make_bkdir()
+        return True
+
+    def db_backup(self):
+        '''数据库备份'''
+        if not self.prepare_backup():
             return
 
-        self.make_bkdir()
         logger.info(f"开始对数据库{self._dbs}进行备份, 请等到完成...")
+        if settings.RM_BK_ASYNC:
+            run_remote_backups([self])
+            logger.info("数据库备份已全部完毕.")
+            return
+
+        single_db_backup = self._single_db_stream_backup if settings.RM_BK_TO_LOCAL else self._single_db_backup
         with ThreadPoolExecutor(max_workers=settings.BK_THREAD_NUM) as executor:
-            tasks = [executor.submit(self._single_db_backup, db) for db in self._dbs]
+            tasks = [executor.submit(single_db_backup, db) for db in self._dbs]
             for task in as_completed(tasks):
                 err = task.exception()
                 if err:
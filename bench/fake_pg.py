@@ -0,0 +1,159 @@
+'''pg_dump/psql/pg_restore/createdb/dropdb的替身, 用于基准测试
+
+第一个参数为模拟的程序名, 其余参数与真实程序相同. 通过环境变量控制生成的数据:
+    FAKE_PG_BYTES   每个数据库的数据量(字节), 按表平均分配
+    FAKE_PG_TABLES  每个数据库的表数量
+    FAKE_PG_RATE    输出/读取速度上限(MB/s), 0表示不限制
+    FAKE_PG_RANDOM  数据中随机内容的比例(0-1), 越大越难压缩
+    FAKE_PG_DBS     逗号分隔的数据库列表, 用于回答数据库大小查询
+'''
+import os
+import sys
+import time
+
+ROW_SIZE = 128
+BLOCK_SIZE = 256 * 1024
+
+
+def env(name, default, cast=int):
+    return cast(os.environ.get(name, default))
+
+
+class Throttle:
+    '''按rate(MB/s)限制吞吐量'''
+
+    def __init__(self, rate):
+        self._rate = rate * 1024 * 1024
+        self._start = time.time()
+        self._bytes = 0
+
+    def wait(self, nbytes):
+        if not self._rate:
+            return
+        self._bytes += nbytes
+        delay = self._bytes / self._rate - (time.time() - self._start)
+        if delay > 0:
+            time.sleep(delay)
+
+
+def make_blocks(total, random_ratio, seed):
+    '''生成COPY格式的行数据, 每块约BLOCK_SIZE字节, 每行ROW_SIZE字节'''
+    random_size = int((ROW_SIZE - 12) * random_ratio) // 2 * 2
+    filler = b"x" * (ROW_SIZE - 12 - random_size)
+    rows_per_block = BLOCK_SIZE // ROW_SIZE
+    row_id = seed * 10 ** 9
+    written = 0
+    while written < total:
+        rows = min(rows_per_block, -(-(total - written) // ROW_SIZE))
+        noise = os.urandom(random_size // 2 * rows).hex().encode()
+        step = random_size
+        block = b"".join(b"%010d\t%s%s\n" % (row_id + i, noise[i * step:(i + 1) * step], filler)
+                         for i in range(rows))
+        row_id += rows
+        written += len(block)
+        yield block
+
+
+def tables(db):
+    count = env("FAKE_PG_TABLES", 8)
+    return [f"public.{db}_t{i:03d}" for i in range(count)]
+
+
+def table_bytes():
+    return env("FAKE_PG_BYTES", 64 * 1024 * 1024) // env("FAKE_PG_TABLES", 8)
+
+
+def write_schema(out, names):
+    for name in names:
+        out.write(f"CREATE TABLE {name} (id bigint primary key, payload text);\n".encode())
+
+
+def write_data(out, names, throttle):
+    random_ratio = env("FAKE_PG_RANDOM", 0.3, float)
+    for index, name in enumerate(names):
+        out.write(f"COPY {name} (id, payload) FROM stdin;\n".encode())
+        for block in make_blocks(table_bytes(), random_ratio, index):
+            out.write(block)
+            throttle.wait(len(block))
+        out.write(b"\\.\n\n")
+
+
+def pg_dump(args):
+    db = args[-1]
+    names = tables(db)
+    if "-t" in args:
+        names = [args[args.index("-t") + 1]]
+    throttle = Throttle(env("FAKE_PG_RATE", 0, float))
+
+    if "-Fd" in args:
+        path = args[args.index("-f") + 1]
+        os.makedirs(path)
+        with open(os.path.join(path, "toc.dat"), "wb") as toc:
+            write_schema(toc, names)
+        for index, name in enumerate(names):
+            with open(os.path.join(path, f"{index + 3000}.dat"), "wb") as f:
+                write_data(f, [name], throttle)
+        return 0
+
+    out = sys.stdout.buffer
+    if "-a" not in args:
+        write_schema(out, names)
+    if "-s" not in args:
+        write_data(out, names, throttle)
+    out.flush()
+    return 0
+
+
+def psql(args):
+    sql = " ".join(args[i + 1] for i, arg in enumerate(args) if arg == "-c")
+    out = sys.stdout
+    if "show server_version" in sql:
+        out.write("16.0\n")
+    elif "pg_database_size" in sql:
+        for db in filter(None, os.environ.get("FAKE_PG_DBS", "").split(",")):
+            out.write(f"{db}\t{env('FAKE_PG_BYTES', 64 * 1024 * 1024)}\n")
+    elif "pg_stat_user_tables" in sql and "n_tup_ins" in sql:
+        for name in tables(args[-1]):
+            out.write(f"{name}\t0\t0\t0\t{table_bytes()}\t1\n")
+    elif "pg_stat_user_tables" in sql:
+        for name in tables(args[-1]):
+            out.write(f"{name}\t{table_bytes()}\n")
+    elif "count(*)" in sql:
+        for name in tables(args[-1]):
+            out.write(f"{name}\t{table_bytes() // ROW_SIZE}\n")
+    elif not sql:
+        # 恢复: 以限定的速度读取全部输入
+        throttle = Throttle(env("FAKE_PG_RATE", 0, float))
+        stdin = sys.stdin.buffer
+        while True:
+            chunk = stdin.read(BLOCK_SIZE)
+            if not chunk:
+                break
+            throttle.wait(len(chunk))
+    return 0
+
+
+def pg_restore(args):
+    throttle = Throttle(env("FAKE_PG_RATE", 0, float))
+    path = args[-1]
+    if "--section=data" in args:
+        for name in os.listdir(path):
+            with open(os.path.join(path, name), "rb") as f:
+                while True:
+                    chunk = f.read(BLOCK_SIZE)
+                    if not chunk:
+                        break
+                    throttle.wait(len(chunk))
+    return 0
+
+
+PROGRAMS = {
+    "pg_dump": pg_dump,
+    "psql": psql,
+    "pg_restore": pg_restore,
+    "createdb": lambda args: 0,
+    "dropdb": lambda args: 0,
+}
+
+if __name__ == "__main__":
+    sys.exit(PROGRAMS[sys.argv[1]](sys.argv[2:]))
@@ -0,0 +1,225 @@
+'''本地SSH服务器替身, 用于远程备份的基准测试
+
+FakeSshServer使用paramiko在本地端口提供密码认证和exec通道, 命令由本地shell在home目录中执行,
+标准输出和标准错误分别写回通道, 退出码作为exit status返回. 配合fake_pg.py即可在本机运行
+RemoteServer和RemoteBackup的全部流程, 命令使用bash -o pipefail, 所以需要在有bash的系统上运行.
+
+latency(往返延迟, 毫秒)或bandwidth(带宽, MB/s)不为0时, 客户端连接的是LinkShaper转发的端口,
+两个方向各延迟latency/2, 所有连接共享带宽, 与真实网络一样由SSH通道窗口决定单个通道的吞吐量.
+
+    with FakeSshServer(home, "postgres", "postgres", latency=20, bandwidth=50) as server:
+        RemoteServer(server.host, server.port, "postgres", "postgres").exec_command("pwd")
+'''
+import time
+import queue
+import socket
+import threading
+import subprocess
+
+import paramiko
+
+BUFFER_SIZE = 64 * 1024
+
+
+class Pacer:
+    '''按rate(MB/s)限制多个连接共享的吞吐量'''
+
+    def __init__(self, rate):
+        self._rate = rate * 1024 * 1024
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self, nbytes):
+        if not self._rate:
+            return
+        with self._lock:
+            now = time.time()
+            self._next = max(self._next, now) + nbytes / self._rate
+            delay = self._next - now
+        time.sleep(delay)
+
+
+class LinkShaper:
+    '''在本地端口和target之间转发TCP数据, 模拟网络延迟和带宽限制
+
+    每个方向由读取线程给数据打上到达时间, 发送线程到时间后按带宽发出,
+    所以延迟不会降低已经在路上的数据的吞吐量.
+    '''
+
+    def __init__(self, target, latency=0, bandwidth=0):
+        self._target = target
+        self._delay = latency / 1000 / 2
+        self._pacers = (Pacer(bandwidth), Pacer(bandwidth))
+        self._sock = socket.create_server((target[0], 0))
+        self._sockets = []
+        self.port = self._sock.getsockname()[1]
+
+    def start(self):
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def stop(self):
+        self._sock.close()
+        for sock in self._sockets:
+            sock.close()
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self._sock.accept()
+            except OSError:
+                return
+            server = socket.create_connection(self._target)
+            for sock in (client, server):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._sockets.extend((client, server))
+            self._pipe(client, server, self._pacers[0])
+            self._pipe(server, client, self._pacers[1])
+
+    def _pipe(self, src, dst, pacer):
+        packets = queue.Queue()
+
+        def read():
+            while True:
+                try:
+                    data = src.recv(BUFFER_SIZE)
+                except OSError:
+                    data = b""
+                packets.put((time.time() + self._delay, data))
+                if not data:
+                    return
+
+        def write():
+            while True:
+                due, data = packets.get()
+                delay = due - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                try:
+                    if not data:
+                        dst.shutdown(socket.SHUT_WR)
+                        return
+                    pacer.wait(len(data))
+                    dst.sendall(data)
+                except OSError:
+                    return
+
+        threading.Thread(target=read, daemon=True).start()
+        threading.Thread(target=write, daemon=True).start()
+
+
+class _ServerInterface(paramiko.ServerInterface):
+    def __init__(self, server):
+        self._server = server
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_auth_password(self, username, password):
+        if (username, password) == (self._server.user, self._server.password):
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED_CONNECT
+
+    def check_channel_exec_request(self, channel, command):
+        self._server.count("commands")
+        threading.Thread(target=self._server.run_command, args=(channel, command.decode()), daemon=True).start()
+        return True
+
+
+class FakeSshServer:
+    '''本地SSH服务器替身, 只支持密码认证和exec命令
+
+    stats中记录建立的连接数和执行的命令数, 用于检查连接池的复用情况.
+    '''
+
+    def __init__(self, home, user, password, latency=0, bandwidth=0, host="127.0.0.1"):
+        self.home = home
+        self.host = host
+        self.user = user
+        self.password = password
+        self.stats = {"connections": 0, "commands": 0}
+        self._lock = threading.Lock()
+        self._key = paramiko.ECDSAKey.generate()
+        self._sock = socket.create_server((host, 0))
+        self._transports = []
+        self._shaper = None
+        if latency or bandwidth:
+            self._shaper = LinkShaper(self._sock.getsockname(), latency, bandwidth)
+
+    @property
+    def port(self):
+        '''客户端连接的端口'''
+        return self._shaper.port if self._shaper else self._sock.getsockname()[1]
+
+    def start(self):
+        threading.Thread(target=self._accept, daemon=True).start()
+        if self._shaper:
+            self._shaper.start()
+        return self
+
+    def stop(self):
+        self._sock.close()
+        if self._shaper:
+            self._shaper.stop()
+        for transport in self._transports:
+            transport.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def _accept(self):
+        while True:
+            try:
+                sock, _ = self._sock.accept()
+            except OSError:
+                return
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            transport = paramiko.Transport(sock)
+            transport.add_server_key(self._key)
+            transport.start_server(server=_ServerInterface(self))
+            self._transports.append(transport)
+            self.count("connections")
+
+    def count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def run_command(self, channel, command):
+        '''在home目录中执行命令, 输出写回通道, 完成后发送退出码并关闭通道'''
+        returncode = 255
+        try:
+            process = subprocess.Popen(command, shell=True, cwd=self.home, stdin=subprocess.DEVNULL,
+                                       stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            stderr = threading.Thread(target=self._pump, args=(process.stderr, channel.sendall_stderr))
+            stderr.start()
+            self._pump(process.stdout, channel.sendall)
+            stderr.join()
+            returncode = process.wait()
+        except Exception as e:
+            channel.sendall_stderr(f"{type(e).__name__}: {e}\n".encode())
+        finally:
+            try:
+                channel.send_exit_status(returncode)
+                channel.close()
+            except (EOFError, OSError, paramiko.SSHException):
+                pass
+
+    @staticmethod
+    def _pump(stream, send):
+        with stream:
+            while True:
+                data = stream.read1(BUFFER_SIZE)
+                if not data:
+                    break
+                try:
+                    send(data)
+                except (EOFError, OSError, paramiko.SSHException):
+                    # 客户端已关闭通道, 继续读取直到命令结束, 避免进程卡在写管道
+                    send = lambda data: None
@@ -0,0 +1,151 @@
+'''备份流程的基准测试
+
+使用fake_pg.py代替PostgreSQL的命令行工具, 在不同的并发数和压缩设置下运行
+db_backup, table_data_backup, table_struct_backup和db_restore, 结果写入JSON文件以便比较.
+替身程序是sh脚本, 只能在POSIX系统(Linux/macOS)上运行.
+
+    python bench/run_bench.py --dbs 4 --size-mb 256 --threads 1,2,4 --codecs gzip:1,gzip:6,zstd:3
+'''
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import datetime
+import platform
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import settings
+
+PROGRAMS = ("pg_dump", "psql", "pg_restore", "createdb", "dropdb")
+
+
+def install_fake_bin(work_dir):
+    '''在work_dir/bin下为每个程序生成调用fake_pg.py的脚本, 并放到PATH的最前面
+
+    Windows中Popen不会通过PATH查找.bat脚本, 所以只支持POSIX系统.
+    '''
+    if os.name != "posix":
+        raise SystemExit("基准测试只支持POSIX系统(Linux/macOS)")
+    bin_dir = os.path.join(work_dir, "bin")
+    os.makedirs(bin_dir)
+    fake_pg = os.path.join(ROOT, "bench", "fake_pg.py")
+    for program in PROGRAMS:
+        path = os.path.join(bin_dir, program)
+        with open(path, "w") as f:
+            f.write(f'#!/bin/sh\nexec "{sys.executable}" "{fake_pg}" {program} "$@"\n')
+        os.chmod(path, 0o755)
+    os.environ["PATH"] = bin_dir + os.pathsep + os.environ["PATH"]
+
+
+def dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total
+
+
+def run_case(scenario, dbs, bk_path, threads, codec, level):
+    from backup import LocalBackup
+
+    settings.BK_THREAD_NUM = threads
+    settings.STRUCT_THREAD_NUM = threads
+    settings.RS_THREAD_NUM = threads
+    settings.BK_COMPRESS_CODEC = codec
+    settings.BK_COMPRESS_LEVEL = level
+
+    backup = LocalBackup("127.0.0.1", 5432, dbs, bk_path)
+    start = time.time()
+    if scenario == "db_backup":
+        backup.db_backup()
+    elif scenario == "table_data_backup":
+        backup.table_data_backup()
+    elif scenario == "table_struct_backup":
+        backup.table_struct_backup()
+    else:
+        backup.db_restore(os.path.join(bk_path, "127.0.0.1"))
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="备份流程基准测试")
+    parser.add_argument("--dbs", type=int, default=4, help="数据库数量")
+    parser.add_argument("--size-mb", type=int, default=64, help="每个数据库的数据量(MB)")
+    parser.add_argument("--tables", type=int, default=8, help="每个数据库的表数量")
+    parser.add_argument("--rate", type=float, default=0, help="替身程序的速度上限(MB/s), 0表示不限制")
+    parser.add_argument("--random", type=float, default=0.3, help="数据中随机内容的比例, 越大越难压缩")
+    parser.add_argument("--threads", default="1,2,4", help="逗号分隔的并发数")
+    parser.add_argument("--codecs", default="gzip:6", help="逗号分隔的压缩算法:级别")
+    parser.add_argument("--scenarios", default="db_backup,table_data_backup,table_struct_backup,db_restore")
+    parser.add_argument("--out", default="bench_results.json", help="结果文件")
+    args = parser.parse_args()
+
+    started = datetime.datetime.now()
+    work_dir = tempfile.mkdtemp(prefix="pg_backup_bench_")
+    out = os.path.abspath(args.out)
+    install_fake_bin(work_dir)
+    dbs = [f"bench{i}" for i in range(args.dbs)]
+    os.environ.update({
+        "FAKE_PG_BYTES": str(args.size_mb * 1024 * 1024),
+        "FAKE_PG_TABLES": str(args.tables),
+        "FAKE_PG_RATE": str(args.rate),
+        "FAKE_PG_RANDOM": str(args.random),
+        "FAKE_PG_DBS": ",".join(dbs),
+    })
+    pgpass = os.path.join(work_dir, "pgpass.conf")
+    with open(pgpass, "w") as f:
+        f.write("127.0.0.1:5432:*:postgres:bench\n")
+    settings.LOCAL_PGPASS_FILE = pgpass
+    settings.CATALOG_FILE = os.path.join(work_dir, "catalog.db")
+
+    # DbBackup会去掉备份路径开头的"/", 所以在工作目录中使用相对路径
+    cwd = os.getcwd()
+    os.chdir(work_dir)
+    results = []
+    try:
+        for codec_level in args.codecs.split(","):
+            codec, _, level = codec_level.partition(":")
+            level = int(level) if level else None
+            for threads in map(int, args.threads.split(",")):
+                # 每组设置使用新的备份目录, 恢复使用同组备份的结果
+                bk_path = f"bk_{codec}_{level}_{threads}"
+                for scenario in args.scenarios.split(","):
+                    before = dir_size(bk_path)
+                    elapsed = run_case(scenario, dbs, bk_path, threads, codec, level)
+                    # 结构备份不包含数据, 不计算吞吐量
+                    raw = 0 if scenario == "table_struct_backup" else args.size_mb * 1024 * 1024 * len(dbs)
+                    result = {
+                        "scenario": scenario,
+                        "threads": threads,
+                        "codec": codec,
+                        "level": level,
+                        "elapsed": round(elapsed, 3),
+                        "raw_bytes": raw,
+                        "output_bytes": dir_size(bk_path) - before,
+                        "throughput": round(raw / 1024 / 1024 / elapsed, 1) if elapsed else 0.0,
+                    }
+                    results.append(result)
+                    print(json.dumps(result, ensure_ascii=False))
+                shutil.rmtree(bk_path, ignore_errors=True)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "started": started.isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "params": vars(args),
+        "results": results,
+    }
+    with open(out, "w") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+'''远程备份流程的基准测试
+
+在本机启动fake_ssh.py中的SSH服务器替身, 远程命令中的pg_dump由fake_pg.py代替, 在不同的网络延迟下测量:
+    connect      建立SSH连接(握手和认证)的耗时
+    round_trip   连接池中已有连接时执行一个空命令的耗时
+    pgpass       远程pgpass的读取(get_remote_pgpass)和检查(RemoteBackup.check_pgpass)的耗时
+    stream       多个通道同时用exec_stream读取数据的总吞吐量
+    db_backup    RemoteBackup.db_backup在备份到远程, 备份到本地和asyncio引擎三种方式下的耗时
+结果写入JSON文件以便比较.
+
+    python bench/run_remote_bench.py --latency 0,20,80 --bandwidth 100 --channels 1,4,8 --dbs 4 --size-mb 64
+'''
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import datetime
+import platform
+import tempfile
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import settings
+from fake_ssh import FakeSshServer
+from run_bench import install_fake_bin, dir_size
+
+USER = PASSWORD = "postgres"
+BACKUP_MODES = {
+    "remote": {"RM_BK_TO_LOCAL": False, "RM_BK_ASYNC": False},
+    "to_local": {"RM_BK_TO_LOCAL": True, "RM_BK_ASYNC": False},
+    "async": {"RM_BK_TO_LOCAL": True, "RM_BK_ASYNC": True},
+}
+
+
+def timings(func, repeat):
+    '''执行repeat次func, 返回耗时的统计(毫秒)'''
+    elapsed = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed.append((time.perf_counter() - start) * 1000)
+    elapsed.sort()
+    return {
+        "count": repeat,
+        "mean_ms": round(statistics.mean(elapsed), 2),
+        "p50_ms": round(elapsed[len(elapsed) // 2], 2),
+        "p95_ms": round(elapsed[min(len(elapsed) - 1, int(len(elapsed) * 0.95))], 2),
+    }
+
+
+def check(result):
+    if not result.status:
+        raise RuntimeError(result.msg)
+
+
+def bench_connect(host, port, repeat):
+    from remote import TransportPool
+
+    def connect():
+        pool = TransportPool()
+        pool.release(pool.acquire(host, port, USER, PASSWORD))
+        pool.close_all()
+
+    return timings(connect, repeat)
+
+
+def bench_round_trip(host, port, repeat):
+    from remote import RemoteServer
+
+    server = RemoteServer(host, port, USER, PASSWORD)
+    return timings(lambda: check(server.exec_command("true")), repeat)
+
+
+def bench_pgpass(host, port, dbs, repeat):
+    from backup import RemoteBackup
+    from utils.common import get_remote_pgpass
+
+    settings.REMOTE_HOST, settings.REMOTE_PORT = host, port
+    backup = RemoteBackup("127.0.0.1", 5432, dbs)
+    backup.init_remove_server(host, port, USER, PASSWORD)
+
+    def check_pgpass():
+        if not backup.check_pgpass():
+            raise RuntimeError("pgpass检查失败")
+
+    return {
+        "get_remote_pgpass": timings(lambda: check(get_remote_pgpass()), repeat),
+        "check_pgpass": timings(check_pgpass, repeat),
+    }
+
+
+def bench_stream(host, port, db, channels):
+    '''channels个通道同时读取一个数据库的pg_dump输出, 返回总字节数和耗时'''
+    from remote import RemoteServer
+
+    server = RemoteServer(host, port, USER, PASSWORD)
+
+    def stream(_):
+        result = server.exec_stream(f"pg_dump {db}")
+        check(result)
+        return result.bytes
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=channels) as executor:
+        nbytes = sum(executor.map(stream, range(channels)))
+    return nbytes, time.time() - start
+
+
+def bench_db_backup(host, port, dbs, mode, threads, home):
+    from backup import RemoteBackup
+
+    for name, value in BACKUP_MODES[mode].items():
+        setattr(settings, name, value)
+    settings.BK_THREAD_NUM = threads
+    bk_path = f"bk_{mode}_{threads}"
+    backup = RemoteBackup("127.0.0.1", 5432, dbs, bk_path)
+    backup.init_remove_server(host, port, USER, PASSWORD)
+    start = time.time()
+    backup.db_backup()
+    elapsed = time.time() - start
+    # 备份到远程时文件在服务器的home目录中
+    out_dir = os.path.join(home, bk_path) if mode == "remote" else bk_path
+    nbytes = dir_size(out_dir)
+    shutil.rmtree(out_dir, ignore_errors=True)
+    return nbytes, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="远程备份流程基准测试")
+    parser.add_argument("--latency", default="0,20,80", help="逗号分隔的网络往返延迟(毫秒)")
+    # get_remote_pgpass不接受127.0.0.1, 默认使用另一个回环地址(Linux中整个127.0.0.0/8都是回环地址)
+    parser.add_argument("--host", default="127.0.0.2", help="SSH服务器替身监听的地址")
+    parser.add_argument("--bandwidth", type=float, default=0, help="所有连接共享的带宽(MB/s), 0表示不限制")
+    parser.add_argument("--channels", default="1,2,4,8", help="逗号分隔的并发通道数, 同时用于备份的线程数")
+    parser.add_argument("--repeat", type=int, default=20, help="连接和命令往返测量的次数")
+    parser.add_argument("--dbs", type=int, default=4, help="数据库数量")
+    parser.add_argument("--size-mb", type=int, default=16, help="每个数据库的数据量(MB)")
+    parser.add_argument("--random", type=float, default=0.3, help="数据中随机内容的比例, 越大越难压缩")
+    parser.add_argument("--modes", default=",".join(BACKUP_MODES), help="逗号分隔的备份方式")
+    parser.add_argument("--out", default="remote_bench_results.json", help="结果文件")
+    args = parser.parse_args()
+
+    from remote import get_pool
+
+    started = datetime.datetime.now()
+    work_dir = tempfile.mkdtemp(prefix="pg_backup_remote_bench_")
+    out = os.path.abspath(args.out)
+    install_fake_bin(work_dir)
+    dbs = [f"bench{i}" for i in range(args.dbs)]
+    os.environ.update({
+        "FAKE_PG_BYTES": str(args.size_mb * 1024 * 1024),
+        "FAKE_PG_TABLES": "4",
+        "FAKE_PG_RANDOM": str(args.random),
+        "FAKE_PG_DBS": ",".join(dbs),
+    })
+    # 服务器替身的home目录, 远程命令在其中执行
+    home = os.path.join(work_dir, "home")
+    os.makedirs(home)
+    with open(os.path.join(home, ".pgpass"), "w") as f:
+        f.write("127.0.0.1:5432:*:postgres:bench\n")
+    settings.REMOTE_USER, settings.REMOTE_PASSWORD = USER, PASSWORD
+    settings.CATALOG_FILE = os.path.join(work_dir, "catalog.db")
+
+    # DbBackup会去掉备份路径开头的"/", 所以在工作目录中使用相对路径
+    cwd = os.getcwd()
+    os.chdir(work_dir)
+    results = []
+
+    def report(case, latency, server, **fields):
+        result = {"case": case, "latency_ms": latency, "bandwidth": args.bandwidth, **fields,
+                  "connections": server.stats["connections"], "commands": server.stats["commands"]}
+        results.append(result)
+        print(json.dumps(result, ensure_ascii=False))
+
+    try:
+        for latency in map(float, args.latency.split(",")):
+            with FakeSshServer(home, USER, PASSWORD, latency, args.bandwidth, args.host) as server:
+                report("connect", latency, server, **bench_connect(server.host, server.port, args.repeat))
+                report("round_trip", latency, server, **bench_round_trip(server.host, server.port, args.repeat))
+                for name, stats in bench_pgpass(server.host, server.port, dbs, args.repeat).items():
+                    report(name, latency, server, **stats)
+                for channels in map(int, args.channels.split(",")):
+                    nbytes, elapsed = bench_stream(server.host, server.port, dbs[0], channels)
+                    report("stream", latency, server, channels=channels, bytes=nbytes, elapsed=round(elapsed, 3),
+                           throughput=round(nbytes / 1024 / 1024 / elapsed, 1) if elapsed else 0.0)
+                for mode in args.modes.split(","):
+                    for threads in map(int, args.channels.split(",")):
+                        nbytes, elapsed = bench_db_backup(server.host, server.port, dbs, mode, threads, home)
+                        raw = args.size_mb * 1024 * 1024 * len(dbs)
+                        report(f"db_backup_{mode}", latency, server, channels=threads, raw_bytes=raw,
+                               output_bytes=nbytes, elapsed=round(elapsed, 3),
+                               throughput=round(raw / 1024 / 1024 / elapsed, 1) if elapsed else 0.0)
+            # 下一个延迟使用新的服务器, 连接池中的连接已经失效
+            get_pool().close_all()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report_data = {
+        "started": started.isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "params": vars(args),
+        "results": results,
+    }
+    with open(out, "w") as f:
+        json.dump(report_data, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+import os
+import json
+import sqlite3
+import datetime
+import threading
+
+import settings
+
+_SCHEMA = '''
+create table if not exists backups (
+    id integer primary key autoincrement,
+    host text not null,
+    db text not null,
+    mode text not null,
+    format text,
+    status integer not null,
+    start_time text not null,
+    end_time text not null,
+    bytes integer,
+    compressed_bytes integer,
+    checksum text,
+    pg_version text,
+    path text,
+    artifacts text,
+    row_counts text,
+    superseded integer not null default 0,
+    pruned integer not null default 0
+);
+create index if not exists backups_host_db_time on backups (host, db, mode, status, end_time);
+create index if not exists backups_db_time on backups (db, mode, status, end_time);
+create index if not exists backups_path on backups (path);
+create index if not exists backups_retention on backups (pruned, host, db, mode, end_time desc);
+create table if not exists restore_tests (
+    id integer primary key autoincrement,
+    backup_id integer,
+    host text not null,
+    db text not null,
+    scratch_db text not null,
+    status integer not null,
+    start_time text not null,
+    end_time text not null,
+    timings text,
+    mismatches text
+);
+create index if not exists restore_tests_db_time on restore_tests (db, end_time);
+'''
+
+
+class BackupCatalog:
+    '''记录所有备份任务的SQLite目录
+
+    每次备份写入一条记录, 覆盖了同一路径的旧备份时, 旧记录标记为superseded.
+    按(host, db, mode, status, end_time)建立索引, 查询某个时间之前最新的成功备份只需一次索引查找.
+    时间以ISO格式的字符串保存, 可以直接按字符串比较.
+    '''
+
+    def __init__(self, file=None):
+        self._file = file or settings.CATALOG_FILE
+        self._lock = threading.Lock()
+        directory = os.path.dirname(self._file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(self._file, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("pragma journal_mode=wal")
+            self._conn.executescript(_SCHEMA)
+            # 旧版本创建的目录没有row_counts列
+            columns = {row[1] for row in self._conn.execute("pragma table_info(backups)")}
+            if "row_counts" not in columns:
+                self._conn.execute("alter table backups add column row_counts text")
+            if "pruned" not in columns:
+                self._conn.execute("alter table backups add column pruned integer not null default 0")
+
+    def record(self, host, db, mode, status, start_time, end_time=None, fmt=None, bytes=None, compressed_bytes=None,
+               checksum=None, pg_version=None, path=None, artifacts=None, row_counts=None):
+        '''写入一条备份记录, 返回记录id
+
+        path为主要的备份文件/目录, artifacts为所有相关文件, row_counts为备份快照中各表的行数.
+        '''
+        end_time = end_time or datetime.datetime.now()
+        path = os.path.abspath(path) if path else None
+        artifacts = [os.path.abspath(artifact) for artifact in artifacts or ([path] if path else [])]
+        # 只有主要文件时不单独保存文件列表, 清理时不需要逐行解析JSON
+        artifacts = None if artifacts == ([path] if path else []) else json.dumps(artifacts, ensure_ascii=False)
+        with self._lock, self._conn:
+            if status and path:
+                self._conn.execute("update backups set superseded = 1 where path = ? and superseded = 0", (path,))
+            cursor = self._conn.execute(
+                "insert into backups (host, db, mode, format, status, start_time, end_time, bytes, compressed_bytes, "
+                "checksum, pg_version, path, artifacts, row_counts) values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (host, db, mode, fmt, int(bool(status)), _isoformat(start_time), _isoformat(end_time), bytes,
+                 compressed_bytes, checksum, pg_version, path, artifacts,
+                 json.dumps(row_counts, ensure_ascii=False) if row_counts is not None else None))
+            return cursor.lastrowid
+
+    def latest(self, db, host=None, mode="full", before=None, path=None):
+        '''查询before之前最新的, 仍然有效并且记录了备份路径的成功备份, path不为空时只查找该目录下的备份'''
+        # 指定path时目录下的记录很少, 强制使用backups_path索引, 避免查询计划选择按db扫描该库的全部记录
+        table = "backups indexed by backups_path" if path else "backups"
+        sql = f"select * from {table} where db = ? and mode = ? and status = 1 and superseded = 0 and pruned = 0 " \
+              "and path is not null"
+        params = [db, mode]
+        if host:
+            sql += " and host = ?"
+            params.append(host)
+        if before:
+            sql += " and end_time <= ?"
+            params.append(_isoformat(before))
+        if path:
+            # 前缀匹配写成范围条件才能使用索引, 前缀以"/"结尾, 上界是把它换成"0"
+            prefix = os.path.join(os.path.abspath(path), "")
+            sql += " and path >= ? and path < ?"
+            params += [prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)]
+        rows = self._query(sql + " order by end_time desc limit 1", params)
+        return rows[0] if rows else None
+
+    def history(self, host=None, db=None, limit=100):
+        '''按时间倒序返回备份记录'''
+        sql, params = "select * from backups where 1 = 1", []
+        if host:
+            sql += " and host = ?"
+            params.append(host)
+        if db:
+            sql += " and db = ?"
+            params.append(db)
+        return self._query(sql + " order by end_time desc limit ?", params + [limit])
+
+    def retention_rows(self):
+        '''返回所有未清理的备份记录, 按(host, db, mode)分组, 组内按时间倒序
+
+        每行为元组(id, host, db, mode, status, superseded, end_time, path, artifacts, compressed_bytes),
+        不使用sqlite3.Row以减少百万行时的开销.
+        '''
+        sql = "select id, host, db, mode, status, superseded, end_time, path, artifacts, compressed_bytes " \
+              "from backups where pruned = 0 order by host, db, mode, end_time desc"
+        with self._lock:
+            cursor = self._conn.cursor()
+            cursor.row_factory = None
+            return cursor.execute(sql).fetchall()
+
+    def mark_pruned(self, ids):
+        '''将备份记录标记为已清理'''
+        with self._lock, self._conn:
+            self._conn.executemany("update backups set pruned = 1 where id = ?", ((id_,) for id_ in ids))
+
+    def record_restore_test(self, backup_id, host, db, scratch_db, status, start_time, timings, mismatches=None):
+        '''记录一次恢复测试, timings为{步骤: 耗时(秒)}, 用于跟踪实际的恢复时间(RTO)'''
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "insert into restore_tests (backup_id, host, db, scratch_db, status, start_time, end_time, timings, "
+                "mismatches) values (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (backup_id, host, db, scratch_db, int(bool(status)), _isoformat(start_time),
+                 _isoformat(datetime.datetime.now()), json.dumps(timings, ensure_ascii=False),
+                 json.dumps(mismatches or {}, ensure_ascii=False)))
+            return cursor.lastrowid
+
+    def restore_tests(self, db=None, limit=100):
+        '''按时间倒序返回恢复测试记录'''
+        sql, params = "select * from restore_tests", []
+        if db:
+            sql += " where db = ?"
+            params.append(db)
+        with self._lock:
+            return [dict(row, timings=json.loads(row["timings"] or "{}"),
+                         mismatches=json.loads(row["mismatches"] or "{}"))
+                    for row in self._conn.execute(sql + " order by end_time desc limit ?", params + [limit])]
+
+    def _query(self, sql, params):
+        with self._lock:
+            return [dict(row, artifacts=_artifacts(row["path"], row["artifacts"]),
+                         row_counts=json.loads(row["row_counts"]) if row["row_counts"] else None)
+                    for row in self._conn.execute(sql, params)]
+
+    def close(self):
+        self._conn.close()
+
+
+def _artifacts(path, artifacts):
+    '''还原记录的文件列表, artifacts为空表示只有主要文件path'''
+    if artifacts is not None:
+        return json.loads(artifacts)
+    return [path] if path else []
+
+
+def _isoformat(value):
+    if isinstance(value, (int, float)):
+        value = datetime.datetime.fromtimestamp(value)
+    return value.isoformat(sep=" ") if isinstance(value, datetime.datetime) else value
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog():
+    '''进程内共享的备份目录'''
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = BackupCatalog()
+        return _catalog
@@ -0,0 +1,237 @@
+import os
+import json
+import time
+import zlib
+import hashlib
+import datetime
+from collections import deque
+
+from utils.compress import CODEC_SUFFIX, DEFAULT_LEVEL, check_codec, compress_block, decompress_block, get_executor
+import settings
+
+
+class LineChunker:
+    '''按内容切分数据流
+
+    备份输出是按行组织的SQL, 以行为单位计算crc32作为滚动的内容指纹:
+    块大小达到min_size后, 遇到crc32 & mask == 0的行就切分, 超过max_size时强制切分.
+    插入或删除数据只会影响附近的块, 其他块的边界保持不变.
+    逐字节的滚动哈希在Python中太慢, 按行计算时哈希由zlib在C中完成.
+    '''
+
+    def __init__(self, min_size=None, max_size=None, mask=None):
+        self._min_size = min_size or settings.DEDUP_MIN_CHUNK
+        self._max_size = max_size or settings.DEDUP_MAX_CHUNK
+        self._mask = mask or settings.DEDUP_LINE_MASK
+        self._lines = []
+        self._size = 0
+        self._partial = b""
+
+    def feed(self, data):
+        '''输入数据, 返回已经切分完成的块'''
+        chunks = []
+        lines = (self._partial + data).split(b"\n")
+        self._partial = lines.pop()
+        for line in lines:
+            line += b"\n"
+            self._lines.append(line)
+            self._size += len(line)
+            if self._size >= self._max_size or \
+                    (self._size >= self._min_size and not zlib.crc32(line) & self._mask):
+                chunks.append(self._cut())
+        # 没有换行的二进制数据按max_size切分
+        while len(self._partial) >= self._max_size:
+            self._lines.append(self._partial[:self._max_size])
+            self._partial = self._partial[self._max_size:]
+            self._size += self._max_size
+            chunks.append(self._cut())
+        return chunks
+
+    def _cut(self):
+        chunk = b"".join(self._lines)
+        self._lines, self._size = [], 0
+        return chunk
+
+    def flush(self):
+        if self._partial:
+            self._lines.append(self._partial)
+            self._partial = b""
+        return [self._cut()] if self._lines else []
+
+
+class ChunkStore:
+    '''按内容寻址的备份仓库
+
+    chunks/ab/<sha256><后缀>  每个块压缩后只保存一次
+    manifests/<host>/<db>/<时间>.json  每次备份是一个按顺序引用块的清单
+    '''
+
+    def __init__(self, root=None, codec=None, level=None):
+        self._root = root or settings.DEDUP_PATH
+        self.codec = codec or settings.BK_COMPRESS_CODEC
+        check_codec(self.codec)
+        self.level = DEFAULT_LEVEL[self.codec] if level is None else level
+
+    @classmethod
+    def for_manifest(cls, manifest_file):
+        '''根据清单文件(<root>/manifests/<host>/<db>/<时间>.json)打开所在的仓库'''
+        root = os.path.abspath(os.path.join(os.path.dirname(manifest_file), "..", "..", ".."))
+        return cls(root)
+
+    def chunk_path(self, digest, codec):
+        return os.path.join(self._root, "chunks", digest[:2], f"{digest}{CODEC_SUFFIX[codec]}")
+
+    def put(self, data):
+        '''保存一个块, 返回(sha256, 新写入的压缩字节数), 已存在的块不重复写入'''
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.chunk_path(digest, self.codec)
+        if os.path.exists(path):
+            # 更新修改时间, 避免正在进行的备份引用的块被collect_garbage删除
+            os.utime(path)
+            return digest, 0
+        compressed = compress_block(self.codec, self.level, data)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{id(data)}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(compressed)
+        os.replace(tmp_path, path)
+        return digest, len(compressed)
+
+    def get(self, digest, codec):
+        with open(self.chunk_path(digest, codec), "rb") as f:
+            data = decompress_block(codec, f.read())
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise RuntimeError(f"块[{digest}]校验失败")
+        return data
+
+    def manifest_dir(self, host, db):
+        return os.path.join(self._root, "manifests", host, db)
+
+    def save_manifest(self, host, db, manifest):
+        path = self.manifest_dir(host, db)
+        os.makedirs(path, exist_ok=True)
+        file = os.path.join(path, f"{datetime.datetime.now():%Y%m%d%H%M%S%f}.json")
+        with open(file, "w") as f:
+            json.dump(manifest, f)
+        return file
+
+    def latest_manifest(self, host, db):
+        path = self.manifest_dir(host, db)
+        if not os.path.exists(path):
+            return None
+        files = sorted(name for name in os.listdir(path) if name.endswith(".json"))
+        return os.path.join(path, files[-1]) if files else None
+
+    def collect_garbage(self, grace=None):
+        '''删除没有被任何清单引用的块, 返回删除的块数
+
+        最近grace秒内写入或被引用过的块不删除, 它们可能属于还没有保存清单的备份.
+        '''
+        grace = settings.DEDUP_GC_GRACE if grace is None else grace
+        deadline = time.time() - grace
+        referenced = set()
+        manifests = os.path.join(self._root, "manifests")
+        for host in _listdir(manifests):
+            for db in _listdir(os.path.join(manifests, host)):
+                for name in _listdir(os.path.join(manifests, host, db)):
+                    if name.endswith(".json"):
+                        with open(os.path.join(manifests, host, db, name), "r") as f:
+                            referenced.update(json.load(f)["chunks"])
+
+        removed = 0
+        chunks = os.path.join(self._root, "chunks")
+        for prefix in _listdir(chunks):
+            with os.scandir(os.path.join(chunks, prefix)) as entries:
+                for entry in entries:
+                    digest = entry.name.split(".")[0]
+                    if digest not in referenced and entry.stat().st_mtime < deadline:
+                        os.remove(entry.path)
+                        removed += 1
+        return removed
+
+    def iter_restore(self, manifest_file, prefetch=None):
+        '''按清单顺序返回原始数据, 后续的块在线程池中提前读取和解压'''
+        with open(manifest_file, "r") as f:
+            manifest = json.load(f)
+        prefetch = prefetch or settings.BK_COMPRESS_THREADS * 2
+        codec = manifest["codec"]
+        executor = get_executor()
+        pending = deque()
+        for digest in manifest["chunks"]:
+            pending.append(executor.submit(self.get, digest, codec))
+            if len(pending) >= prefetch:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _listdir(path):
+    return os.listdir(path) if os.path.isdir(path) else []
+
+
+class DedupSink:
+    '''将数据流切块后并行压缩写入ChunkStore
+
+    关闭时只等待所有块写完, 命令成功后由调用方调用commit()保存清单, 失败或截断的备份不会留下清单.
+    '''
+
+    def __init__(self, store, host, db):
+        self._store = store
+        self._host = host
+        self._db = db
+        self._chunker = LineChunker()
+        self._pending = deque()
+        self._max_pending = settings.BK_COMPRESS_THREADS * 2
+        self._digests = []
+        self._closed = False
+        self.bytes_in = 0
+        self.bytes_stored = 0
+        self.new_chunks = 0
+        self.compress_time = 0.0
+        self.manifest_file = None
+
+    def write(self, data):
+        self.bytes_in += len(data)
+        for chunk in self._chunker.feed(data):
+            self._submit(chunk)
+
+    def _submit(self, chunk):
+        self._pending.append(get_executor().submit(self._store.put, chunk))
+        while len(self._pending) > self._max_pending:
+            self._collect()
+
+    def _collect(self):
+        start = time.time()
+        digest, stored = self._pending.popleft().result()
+        # 块的压缩和写入都在线程池中, 等待的时间记为压缩
+        self.compress_time += time.time() - start
+        self._digests.append(digest)
+        self.bytes_stored += stored
+        self.new_chunks += 1 if stored else 0
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        for chunk in self._chunker.flush():
+            self._submit(chunk)
+        while self._pending:
+            self._collect()
+
+    def commit(self):
+        '''保存清单, 返回清单文件路径'''
+        self.close()
+        manifest = {
+            "host": self._host,
+            "db": self._db,
+            "created": datetime.datetime.now().isoformat(),
+            "codec": self._store.codec,
+            "bytes": self.bytes_in,
+            "chunks": self._digests,
+        }
+        self.manifest_file = self._store.save_manifest(self._host, self._db, manifest)
+        return self.manifest_file
+
+    @property
+    def chunks(self):
+        return len(self._digests)
@@ -0,0 +1,107 @@
+import os
+import json
+import time
+import datetime
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from backup import LocalBackup
+from configParser import get_host, get_db
+from core import get_logger
+from utils.declare import JobResult
+from utils.jobs import WorkerBudget, log_summary
+import settings
+
+logger = get_logger()
+
+
+class FleetBackup:
+    '''备份config.json中所有主机的所有数据库
+
+    所有任务共享workers个线程, 每个主机同时运行的任务不超过host_limit个,
+    避免单个服务器负载过高. 派发时按主机轮流进行, 每个主机内部从大到小.
+    '''
+
+    def __init__(self, hosts=None, dbs=None, port=5432, bk_path=".", workers=None, host_limit=None):
+        self._hosts = list(hosts) if hosts else list(get_host())
+        self._dbs = list(dbs) if dbs else list(get_db())
+        self._port = port
+        self._bk_path = bk_path
+        self._workers = workers or settings.FLEET_THREAD_NUM
+        self._host_limit = host_limit or settings.FLEET_HOST_THREAD_NUM
+
+    def run(self):
+        '''执行备份, 返回JobResult列表'''
+        backups, queues = {}, {}
+        for host in self._hosts:
+            backup = LocalBackup(host, self._port, self._dbs, self._bk_path)
+            if not backup.check_pgpass():
+                logger.error(f"主机[{host}]的数据库没有全部配置到pgpass文件, 跳过该主机")
+                continue
+            sizes = backup.get_db_sizes()
+            backups[host] = backup
+            queues[host] = sorted(self._dbs, key=lambda db: sizes.get(db, 0), reverse=True)
+
+        jobs_num = sum(len(queue) for queue in queues.values())
+        logger.info(f"开始备份{len(queues)}个主机的{jobs_num}个数据库, 请等待完成...")
+        start = time.time()
+        budget = WorkerBudget(settings.BK_DUMP_JOBS, jobs_num, self._workers)
+        results = self._dispatch(backups, queues, budget)
+        elapsed = time.time() - start
+
+        log_summary(results, "全部主机备份")
+        self._write_report(results, elapsed)
+        logger.info(f"全部主机备份已完成, 总耗时:{elapsed:.1f}秒.")
+        return results
+
+    def _dispatch(self, backups, queues, budget):
+        running, per_host, results = {}, Counter(), []
+        with ThreadPoolExecutor(max_workers=self._workers) as executor:
+            while queues or running:
+                for host in list(queues):
+                    if len(running) >= self._workers:
+                        break
+                    if per_host[host] >= self._host_limit:
+                        continue
+                    db = queues[host].pop(0)
+                    if not queues[host]:
+                        del queues[host]
+                    future = executor.submit(backups[host].single_db_backup, db, budget)
+                    running[future] = (host, db, time.time())
+                    per_host[host] += 1
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    host, db, started = running.pop(future)
+                    per_host[host] -= 1
+                    exception = future.exception()
+                    if exception:
+                        logger.error(exception)
+                    result = exception or future.result()
+                    status = not exception and getattr(result, "status", result is not False)
+                    results.append(JobResult(name=f"{host}/{db}", status=bool(status), elapsed=time.time() - started,
+                                             result=result))
+        return results
+
+    def _write_report(self, results, elapsed):
+        '''将所有任务的结果写入bk_path下的fleet_report.json'''
+        report = {
+            "finished": datetime.datetime.now().isoformat(),
+            "elapsed": round(elapsed, 3),
+            "jobs": [{
+                "job": result.name,
+                "status": result.status,
+                "elapsed": round(result.elapsed, 3),
+                "bytes": getattr(result.result, "bytes", 0),
+                "usage": [usage._asdict() for usage in getattr(result.result, "usage", ())],
+            } for result in sorted(results, key=lambda result: result.name)],
+        }
+        os.makedirs(self._bk_path, exist_ok=True)
+        file = os.path.join(self._bk_path, "fleet_report.json")
+        with open(file, "w") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        logger.info(f"全部主机备份报告:{file}")
+
+
+if __name__ == "__main__":
+    FleetBackup().run()
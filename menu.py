@@ -5,9 +5,11 @@ from PyQt5.QtCore import Qt
 from PyQt5.QtGui import QFont
 
 from windows import BackupWindow, RestoreWindow, StructBackupWindow, DataBackupWindow, SingleBackupWindow, \
-    RemoteBackupWindow, ServerConfWindow, AddPgpassWindow, DelPgpassWindow
+    RemoteBackupWindow, ServerConfWindow, AddPgpassWindow, DelPgpassWindow, FleetBackupWindow, VerifyWindow, \
+    RestoreTestWindow
 import settings
 from utils.common import get_local_pgpass, get_remote_pgpass
+from catalog import get_catalog
 
 
 class MainMenu(QMainWindow):
@@ -84,10 +86,26 @@ class MainMenu(QMainWindow):
         backupAct.triggered.connect(self.db_backup)
         menu.addAction(backupAct)
 
+        fleetAct = QAction("全部主机备份", self)
+        fleetAct.triggered.connect(self.fleet_backup)
+        menu.addAction(fleetAct)
+
         restoreAct = QAction("数据库恢复", self)
         restoreAct.triggered.connect(self.db_restore)
         menu.addAction(restoreAct)
 
+        restoreTestAct = QAction("恢复测试", self)
+        restoreTestAct.triggered.connect(self.restore_test)
+        menu.addAction(restoreTestAct)
+
+        historyAct = QAction("备份记录", self)
+        historyAct.triggered.connect(self.show_backup_history)
+        menu.addAction(historyAct)
+
+        verifyAct = QAction("备份校验", self)
+        verifyAct.triggered.connect(self.verify_backup)
+        menu.addAction(verifyAct)
+
         menu.addSeparator()
 
         remoteBkAct = QAction("远程备份", self)
@@ -183,6 +201,14 @@ class MainMenu(QMainWindow):
         except Exception as e:
             QMessageBox.warning(self, "warning", str(e))
 
+    def fleet_backup(self):
+        '''全部主机备份'''
+        try:
+            self.fleetBkUI = FleetBackupWindow()
+            self.fleetBkUI.show()
+        except Exception as e:
+            QMessageBox.warning(self, "warning", str(e))
+
     def db_restore(self):
         '''数据库恢复'''
         try:
@@ -191,6 +217,35 @@ class MainMenu(QMainWindow):
         except Exception as e:
             QMessageBox.warning(self, "warning", str(e))
 
+    def restore_test(self):
+        '''恢复测试'''
+        try:
+            self.restoreTestUI = RestoreTestWindow()
+            self.restoreTestUI.show()
+        except Exception as e:
+            QMessageBox.warning(self, "warning", str(e))
+
+    def show_backup_history(self):
+        '''显示最近的备份记录'''
+        try:
+            lines = []
+            for record in get_catalog().history():
+                status = "成功" if record["status"] else "失败"
+                lines.append(f"{record['end_time']}  {record['host']}/{record['db']}  {record['mode']}"
+                             f"({record['format']})  {status}  大小:{record['bytes'] or 0}字节  "
+                             f"文件:{record['path'] or ''}")
+            self.text_widget.setText("\n".join(lines) or "没有备份记录")
+        except Exception as e:
+            QMessageBox.warning(self, "warning", str(e))
+
+    def verify_backup(self):
+        '''备份校验'''
+        try:
+            self.verifyUI = VerifyWindow()
+            self.verifyUI.show()
+        except Exception as e:
+            QMessageBox.warning(self, "warning", str(e))
+
     def remote_backup(self):
         '''远程备份'''
         try:
@@ -1,6 +1,130 @@
+import time
+import select
+import threading
+from contextlib import contextmanager
+
 import paramiko
 
 from utils.declare import Status
+from utils.runner import StderrTail, BufferSink, make_result
+import settings
+
+
+class PooledTransport:
+    '''连接池中的一个SSH连接'''
+
+    def __init__(self, key, transport):
+        self.key = key
+        self.transport = transport
+        self.channels = 0
+        self.last_used = time.time()
+
+    def is_healthy(self):
+        return self.transport.is_active() and self.transport.is_authenticated()
+
+    def close(self):
+        try:
+            self.transport.close()
+        except Exception:
+            pass
+
+
+class TransportPool:
+    '''按(host, port, user, password)复用SSH连接的连接池
+
+    每个连接最多同时打开max_channels个通道, 超过时为同一个key再建立新连接,
+    每个key最多max_transports个连接, 都满时等待其他通道释放.
+    空闲超过idle_timeout的连接会被关闭, 连接开启keepalive, 复用前检查连接是否可用.
+    '''
+
+    def __init__(self, max_channels=None, max_transports=None, idle_timeout=None, keepalive=None):
+        self._max_channels = max_channels or settings.SSH_MAX_CHANNELS
+        self._max_transports = max_transports or settings.SSH_MAX_TRANSPORTS
+        self._idle_timeout = idle_timeout or settings.SSH_IDLE_TIMEOUT
+        self._keepalive = keepalive or settings.SSH_KEEPALIVE
+        self._pool = {}
+        self._connecting = {}
+        self._cond = threading.Condition()
+
+    def _connect(self, key):
+        host, port, user, password = key
+        transport = paramiko.Transport((host, port))
+        try:
+            transport.set_keepalive(self._keepalive)
+            transport.connect(username=user, password=password)
+        except BaseException:
+            transport.close()
+            raise
+        return PooledTransport(key, transport)
+
+    def acquire(self, host, port, user, password):
+        '''租用一个通道名额, 返回可以打开新通道的PooledTransport'''
+        key = (host, port, user, password)
+        with self._cond:
+            while True:
+                self._evict_idle()
+                entries = self._pool.setdefault(key, [])
+                for entry in list(entries):
+                    if not entry.is_healthy():
+                        entries.remove(entry)
+                        entry.close()
+                        continue
+                    if entry.channels < self._max_channels:
+                        entry.channels += 1
+                        return entry
+                if len(entries) + self._connecting.get(key, 0) < self._max_transports:
+                    self._connecting[key] = self._connecting.get(key, 0) + 1
+                    break
+                self._cond.wait(timeout=1)
+
+        # 在锁外建立连接, 避免阻塞其他主机
+        try:
+            entry = self._connect(key)
+            entry.channels = 1
+        finally:
+            with self._cond:
+                self._connecting[key] -= 1
+                self._cond.notify_all()
+        with self._cond:
+            self._pool.setdefault(key, []).append(entry)
+        return entry
+
+    def release(self, entry):
+        with self._cond:
+            entry.channels -= 1
+            entry.last_used = time.time()
+            self._cond.notify_all()
+
+    def discard(self, entry):
+        '''丢弃不可用的连接'''
+        with self._cond:
+            entries = self._pool.get(entry.key, [])
+            if entry in entries:
+                entries.remove(entry)
+            entry.close()
+            self._cond.notify_all()
+
+    def _evict_idle(self):
+        now = time.time()
+        for entries in self._pool.values():
+            for entry in list(entries):
+                if not entry.channels and now - entry.last_used > self._idle_timeout:
+                    entries.remove(entry)
+                    entry.close()
+
+    def close_all(self):
+        with self._cond:
+            for entries in self._pool.values():
+                for entry in entries:
+                    entry.close()
+            self._pool.clear()
+
+
+_pool = TransportPool()
+
+
+def get_pool():
+    return _pool
 
 
 class RemoteServer:
@@ -12,24 +136,144 @@ class RemoteServer:
 
         self.init_server_connect()
 
+    @property
+    def host(self):
+        return self._host
+
     def init_server_connect(self):
-        trans = paramiko.Transport((self._host, self._port))
-        trans.connect(username=self._user, password=self._password)
-        self.ssh = paramiko.SSHClient()
-        self.ssh._transport = trans
+        '''从连接池获取连接, 以便尽早发现连接或认证错误'''
+        entry = _pool.acquire(self._host, self._port, self._user, self._password)
+        _pool.release(entry)
+
+    @contextmanager
+    def _lease(self, opener, on_retry=None):
+        '''从连接池租用一个通道名额并用opener打开通道, 连接失效时重连一次, 重连前调用on_retry()'''
+        entry = _pool.acquire(self._host, self._port, self._user, self._password)
+        try:
+            try:
+                channel = opener(entry.transport)
+            except (paramiko.SSHException, EOFError, OSError):
+                if on_retry:
+                    on_retry()
+                _pool.discard(entry)
+                entry = _pool.acquire(self._host, self._port, self._user, self._password)
+                channel = opener(entry.transport)
+            try:
+                yield channel
+            finally:
+                channel.close()
+        finally:
+            _pool.release(entry)
+
+    def session(self, window_size=None, on_retry=None):
+        '''从连接池租用一个会话通道
+
+        window_size为通道的接收窗口, 决定了每个通道在本地缓冲的最大数据量.
+        '''
+        window_size = window_size or settings.SSH_WINDOW_SIZE
+        return self._lease(lambda transport: transport.open_session(window_size=window_size), on_retry)
+
+    def sftp(self, window_size=None):
+        '''从连接池租用一个SFTP通道'''
+        window_size = window_size or settings.SSH_WINDOW_SIZE
+        return self._lease(lambda transport: paramiko.SFTPClient.from_transport(transport, window_size=window_size))
 
     def check_dir(self, path):
         return self.exec_command(f"ls {path}")
 
-    def exec_command(self, command):
-        stdin, stdout, stderr = self.ssh.exec_command(command)
-        err = stderr.read()
-        if err:
-            return Status(status=False, msg=err)
-        return Status(status=True, msg=stdout.read())
+    def exec_command(self, command, timeout=None):
+        '''执行远程命令, 以退出码判断是否成功, 成功时msg为标准输出的文本'''
+        buffer = BufferSink()
+        result = self.exec_stream(command, sinks=[buffer], timeout=timeout)
+        if not result.status:
+            return Status(status=False, msg=result.msg)
+        return Status(status=True, msg=buffer.getvalue().decode(settings.REMOTE_ENCODING, errors="replace"))
+
+    def exec_stream(self, command, sinks=(), chunk_size=None, tail_lines=None, timeout=None):
+        '''执行远程命令, 以流的方式将标准输出写入sinks, 以退出码判断是否成功'''
+        start = time.time()
+        tail = StderrTail(tail_lines)
+        nbytes, retries = 0, []
+        try:
+            with self.session(on_retry=lambda: retries.append(1)) as channel:
+                channel.exec_command(command)
+                channel.shutdown_write()
+                for chunk in read_channel(channel, tail, chunk_size, timeout):
+                    nbytes += len(chunk)
+                    for sink in sinks:
+                        sink.write(chunk)
+                returncode = channel.recv_exit_status()
+        except TimeoutError as e:
+            tail.write(str(e).encode(settings.REMOTE_ENCODING))
+            returncode = -1
+        finally:
+            for sink in sinks:
+                sink.close()
+        tail.close()
+        return make_result([returncode], [tail], nbytes, start, settings.REMOTE_ENCODING, len(retries))
+
+    def exec_iter(self, command, chunk_size=None, timeout=None):
+        '''执行远程命令并以迭代器的方式返回标准输出, 命令失败时抛出RuntimeError'''
+        tail = StderrTail()
+        with self.session() as channel:
+            channel.exec_command(command)
+            channel.shutdown_write()
+            yield from read_channel(channel, tail, chunk_size, timeout)
+            returncode = channel.recv_exit_status()
+        tail.close()
+        if returncode != 0:
+            raise RuntimeError(tail.text(settings.REMOTE_ENCODING) or f"命令执行失败, 退出码:{returncode}")
+
+
+def poll_channel(channel, tail, chunk_size, limit=None):
+    '''读取通道中已经到达的数据, 返回(stdout数据块列表, 命令是否结束)
+
+    stdout和stderr交替读取, stderr写入tail. 每次recv都会让对方继续发送(调整窗口),
+    所以一次最多读取limit(默认SSH_WINDOW_SIZE)字节就返回, 返回的数据不超过窗口大小.
+    只有收到EOF(或通道关闭)并读完缓冲区才算结束: sshd在子进程退出时就发送exit-status,
+    管道中剩余的输出在它之后才发送, 以exit_status_ready()判断结束会丢失输出的末尾.
+    '''
+    limit = limit or settings.SSH_WINDOW_SIZE
+    chunks, nbytes = [], 0
+    while nbytes < limit:
+        received = False
+        if channel.recv_ready():
+            data = channel.recv(min(chunk_size, limit - nbytes))
+            if data:
+                chunks.append(data)
+                nbytes += len(data)
+                received = True
+        if channel.recv_stderr_ready():
+            data = channel.recv_stderr(chunk_size)
+            if data:
+                tail.write(data)
+                received = True
+        if not received:
+            break
+
+    done = channel.eof_received or channel.closed
+    return chunks, done and not channel.recv_ready() and not channel.recv_stderr_ready()
+
+
+def read_channel(channel, tail, chunk_size=None, timeout=None):
+    '''在一个线程中同时读取通道的stdout和stderr
 
-    def __del__(self):
-        self.ssh.close()
+    stdout按块返回, stderr写入tail, 两个流都及时读取, 不会因为一个流的窗口写满而卡住.
+    timeout为整个命令的超时时间(秒), 超时后抛出TimeoutError.
+    '''
+    chunk_size = chunk_size or settings.STREAM_CHUNK_SIZE
+    timeout = timeout or settings.SSH_CMD_TIMEOUT
+    deadline = time.time() + timeout if timeout else None
+    while True:
+        chunks, done = poll_channel(channel, tail, chunk_size)
+        yield from chunks
+        if done:
+            break
+        if deadline and time.time() > deadline:
+            raise TimeoutError(f"命令执行超时({timeout}秒)")
+        if not chunks:
+            # 通道有数据或状态变化时fileno可读
+            select.select([channel], [], [], 0.1)
 
 
 if __name__ == "__main__":
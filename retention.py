@@ -0,0 +1,156 @@
+import os
+import sys
+import json
+import time
+import shutil
+import datetime
+import functools
+from collections import namedtuple
+from itertools import groupby
+from concurrent.futures import ThreadPoolExecutor
+
+from catalog import get_catalog
+from core import get_logger
+from dedup import ChunkStore
+from utils.checksum import sidecar_path
+import settings
+
+logger = get_logger()
+GfsPolicy = namedtuple("GfsPolicy", ["last", "daily", "weekly", "monthly", "yearly"])
+
+
+@functools.lru_cache(maxsize=None)
+def _iso_week(day):
+    return datetime.date.fromisoformat(day).isocalendar()[:2]
+
+
+# 每个级别的时间段, 由ISO格式的时间字符串计算: 同一时间段内只保留最新的一个备份
+PERIODS = (
+    ("daily", lambda t: t[:10]),
+    ("weekly", lambda t: _iso_week(t[:10])),
+    ("monthly", lambda t: t[:7]),
+    ("yearly", lambda t: t[:4]),
+)
+
+
+def get_policy():
+    return GfsPolicy(last=settings.RT_KEEP_LAST, daily=settings.RT_KEEP_DAILY, weekly=settings.RT_KEEP_WEEKLY,
+                     monthly=settings.RT_KEEP_MONTHLY, yearly=settings.RT_KEEP_YEARLY)
+
+
+def gfs_keep(backups, policy):
+    '''按祖父-父-子(GFS)策略选择需要保留的备份
+
+    backups为按时间倒序的[(id, ISO格式的时间)], 保留最新的last个, 以及最近daily天, weekly周,
+    monthly月, yearly年中每个时间段最新的一个备份. 返回需要保留的id集合.
+    '''
+    keep = {id_ for id_, _ in backups[:policy.last]}
+    for level, period in PERIODS:
+        count = getattr(policy, level)
+        seen = set()
+        for id_, end_time in backups:
+            key = period(end_time)
+            if key in seen:
+                continue
+            if len(seen) >= count:
+                break
+            seen.add(key)
+            keep.add(id_)
+    return keep
+
+
+class RetentionEngine:
+    '''根据备份目录(catalog)按GFS策略清理旧的备份
+
+    需要删除的文件完全由目录中的记录计算, 不需要遍历备份目录, 所以dry_run只需要一次查询.
+    删除时按批次在线程池中并发进行, 完成后将记录标记为已清理.
+    被同一路径的新备份覆盖(superseded)的记录只标记, 不删除文件.
+    '''
+
+    def __init__(self, policy=None, workers=None, batch_size=None):
+        self._policy = policy or get_policy()
+        self._workers = workers or settings.RT_THREAD_NUM
+        self._batch_size = batch_size or settings.RT_BATCH_SIZE
+
+    def plan(self):
+        '''计算清理计划, 返回({需要清理的记录id: 文件列表}, 需要删除的文件列表, 保留的记录数, 释放的字节数)'''
+        rows = get_catalog().retention_rows()
+        prune, candidates, protected = {}, [], set()
+        kept, freed = 0, 0
+        for _, group in groupby(rows, key=lambda row: row[1:4]):
+            group = list(group)
+            keep = gfs_keep([(row[0], row[6]) for row in group if row[4] and not row[5]], self._policy)
+            for id_, _, _, _, _, superseded, _, path, artifacts, compressed_bytes in group:
+                artifacts = json.loads(artifacts) if artifacts is not None else [path] if path else []
+                if id_ in keep:
+                    kept += 1
+                    protected.update(artifacts)
+                    continue
+                prune[id_] = [] if superseded else artifacts
+                if not superseded:
+                    freed += compressed_bytes or 0
+                    candidates.extend(artifacts)
+        # 同一个文件可能被保留的记录引用(例如按表增量备份复用的文件)
+        files = [file for file in dict.fromkeys(candidates) if file not in protected]
+        return prune, files, kept, freed
+
+    def run(self, dry_run=True):
+        '''执行清理, dry_run为True时只计算并输出计划, 返回报告字典'''
+        start = time.time()
+        prune, files, kept, freed = self.plan()
+        report = {
+            "dry_run": dry_run,
+            "policy": self._policy._asdict(),
+            "kept": kept,
+            "pruned": len(prune),
+            "files": len(files),
+            "freed_bytes": freed,
+            "failed": [],
+        }
+        if dry_run:
+            report["elapsed"] = round(time.time() - start, 3)
+            logger.info(f"清理计划: 保留{kept}个备份, 清理{len(prune)}个备份, 删除{len(files)}个文件, "
+                        f"预计释放:{freed}字节, 耗时:{report['elapsed']}秒.")
+            return report
+
+        batches = [files[i:i + self._batch_size] for i in range(0, len(files), self._batch_size)]
+        with ThreadPoolExecutor(max_workers=self._workers) as executor:
+            for failed in executor.map(self._delete_batch, batches):
+                report["failed"].extend(failed)
+        # 文件删除失败的记录不标记, 下次清理时重试
+        failed = set(report["failed"])
+        get_catalog().mark_pruned([id_ for id_, artifacts in prune.items() if failed.isdisjoint(artifacts)])
+        if settings.RT_DEDUP_GC:
+            report["chunks"] = self._collect_chunks(files)
+
+        report["elapsed"] = round(time.time() - start, 3)
+        logger.info(f"清理完成: 保留{kept}个备份, 清理{len(prune)}个备份, 删除{len(files)}个文件, "
+                    f"失败{len(report['failed'])}个, 释放:{freed}字节, 耗时:{report['elapsed']}秒.")
+        return report
+
+    @staticmethod
+    def _delete_batch(files):
+        failed = []
+        for file in files:
+            try:
+                if os.path.isdir(file):
+                    shutil.rmtree(file)
+                elif os.path.exists(file):
+                    os.remove(file)
+                if os.path.exists(sidecar_path(file)):
+                    os.remove(sidecar_path(file))
+            except OSError as e:
+                logger.error(f"删除文件[{file}]失败: {e}")
+                failed.append(file)
+        return failed
+
+    @staticmethod
+    def _collect_chunks(files):
+        '''删除了去重清单后, 清理对应仓库中不再被引用的块'''
+        roots = {os.path.abspath(os.path.join(os.path.dirname(file), "..", "..", ".."))
+                 for file in files if file.endswith(".json") and os.sep + "manifests" + os.sep in file}
+        return sum(ChunkStore(root).collect_garbage() for root in roots)
+
+
+if __name__ == "__main__":
+    RetentionEngine().run(dry_run="--apply" not in sys.argv)
@@ -1,14 +1,95 @@
+import os
+
 #配置文件路径
 CONFIG_FILE = "config.json"
+CATALOG_FILE = "catalog.db"  #记录所有备份的SQLite目录
+LOCAL_PGPASS_FILE = None  #本地pgpass文件, None表示使用PGPASSFILE环境变量或Windows下的默认位置
 
 #基本设置
 BK_THREAD_NUM = 5  #并发线程数量
+BK_FORMAT = "plain"  #备份格式: plain(sql + gzip), directory(pg_dump -Fd -j 并发备份), dedup(按内容切块去重)
+BK_DUMP_JOBS = os.cpu_count() or 4  #directory格式下所有数据库共享的pg_dump并发总数
+STRUCT_THREAD_NUM = 16  #表结构备份的并发数量, 主要是连接等待, 可以比BK_THREAD_NUM大
+BK_DATA_SPLIT_TABLES = False  #数据备份时是否按表并发备份(共享同一个快照)
+BK_TABLE_THREAD_NUM = 4  #每个数据库按表备份时的并发数量
+BK_DATA_INCREMENTAL = False  #按表备份时跳过上次备份后没有变化的表
+BK_ROW_COUNTS = False  #备份时在同一个快照中统计表的行数, 用于恢复测试时比较
+BK_ROW_COUNT_TABLES = None  #需要统计行数的表, None表示所有用户表
+BK_TABLE_SPLIT_SIZE = 32 * 1024 ** 3  #单表数据备份时超过该大小的表按范围拆分并发导出
+BK_TABLE_PART_SIZE = 4 * 1024 ** 3  #拆分后每个部分的大小
+BK_TABLE_SPLIT_BY = "pk"  #拆分方式: pk(单列整数主键, 没有时退回ctid), ctid
+SNAPSHOT_TIMEOUT = 60  #导出快照的超时时间(秒)
+FLEET_THREAD_NUM = 10  #全部主机备份时的并发总数
+FLEET_HOST_THREAD_NUM = 2  #全部主机备份时每个主机的并发数
+BK_EST_SPEED = 50  #预估的备份速度(MB/s), 用于计算计划的makespan
+
+#恢复设置
+RS_THREAD_NUM = 3  #同时恢复的数据库数量
+RS_MAX_JOBS = os.cpu_count() or 4  #所有数据库共享的pg_restore并发总数(连接数/CPU上限)
+
+#压缩设置
+BK_COMPRESS_CODEC = "gzip"  #压缩算法: gzip, zstd, lz4
+BK_COMPRESS_LEVEL = None  #压缩级别, None表示使用算法的默认级别
+BK_COMPRESS_THREADS = os.cpu_count() or 4  #所有备份共享的压缩线程数
+BK_COMPRESS_BLOCK_SIZE = 4 * 1024 * 1024  #独立压缩的块大小
+
+#校验设置
+CHECKSUM_ALGORITHM = "sha256"  #备份时计算的摘要算法: sha256等hashlib算法, blake3, xxh64, xxh3_64, xxh3_128
+VERIFY_PROCESS_NUM = os.cpu_count() or 4  #校验备份文件的进程数
+VERIFY_CHUNK_SIZE = 8 * 1024 * 1024  #校验时每次读取的大小
+
+#去重设置
+DEDUP_PATH = None  #去重仓库目录, None表示使用备份目录下的dedup目录
+DEDUP_MIN_CHUNK = 512 * 1024  #块的最小大小
+DEDUP_MAX_CHUNK = 8 * 1024 * 1024  #块的最大大小
+DEDUP_LINE_MASK = 0x3ff  #达到最小大小后, 行的crc32 & mask为0时切分, 越大块越大
+DEDUP_GC_GRACE = 24 * 3600  #清理未引用的块时, 跳过最近该时间(秒)内写入或引用过的块
+
+#指标设置
+METRICS_JSONL_FILE = "metrics.jsonl"  #每个备份任务结束时追加一行指标的JSON lines文件, None表示不导出
+METRICS_PROM_FILE = None  #Prometheus textfile collector读取的.prom文件, None表示不导出
+BK_FSYNC = False  #备份文件写完后是否fsync到磁盘, 耗时记入指标的fsync阶段
+
+#保留策略设置(祖父-父-子)
+BK_KEEP_HISTORY = False  #完整备份的文件名是否带时间, 为True时不覆盖上一次的备份, 由保留策略清理
+RT_KEEP_LAST = 1  #总是保留最新的备份数
+RT_KEEP_DAILY = 7  #保留最近多少天每天最新的备份
+RT_KEEP_WEEKLY = 4  #保留最近多少周每周最新的备份
+RT_KEEP_MONTHLY = 12  #保留最近多少月每月最新的备份
+RT_KEEP_YEARLY = 0  #保留最近多少年每年最新的备份
+RT_THREAD_NUM = 8  #删除文件的并发线程数
+RT_BATCH_SIZE = 500  #每个删除任务处理的文件数
+RT_DEDUP_GC = True  #清理去重清单后是否删除不再被引用的块
+
+#命令执行设置
+CMD_ENCODING = "gbk"  #命令输出的编码
+STREAM_CHUNK_SIZE = 1024 * 1024  #读取命令输出的块大小
+STDERR_TAIL_LINES = 50  #保留的错误输出行数
 
 #默认的远程服务器配置
 REMOTE_HOST = "127.0.0.1"
 REMOTE_PORT = 22
 REMOTE_USER = ""
 REMOTE_PASSWORD = ""
+REMOTE_ENCODING = "utf-8"  #远程命令输出的编码
+
+#SSH连接池设置
+SSH_KEEPALIVE = 30  #keepalive间隔(秒)
+SSH_IDLE_TIMEOUT = 300  #空闲连接超过该时间(秒)后关闭
+SSH_MAX_CHANNELS = 8  #每个连接最多同时打开的通道数
+SSH_MAX_TRANSPORTS = 4  #每个主机最多建立的连接数
+SSH_WINDOW_SIZE = 4 * 1024 * 1024  #每个通道的接收窗口大小, 用于流量控制
+SSH_CMD_TIMEOUT = None  #远程命令的默认超时时间(秒), None表示不超时
+
+#SFTP下载设置
+SFTP_THREAD_NUM = 4  #每个文件同时下载的范围数
+SFTP_RANGE_SIZE = 64 * 1024 * 1024  #每个范围的大小
+
+#远程备份设置
+RM_BK_TO_LOCAL = False  #远程备份时是否将备份数据通过SSH直接写入本地备份目录
+RM_BK_ASYNC = False  #远程备份是否使用asyncio引擎执行
+AIO_MAX_JOBS = 64  #asyncio引擎同时执行的远程命令总数
+AIO_HOST_JOBS = 8  #asyncio引擎每个主机同时执行的远程命令数
 
 #日志设置
 LOG_NAME = "database_backup"
@@ -0,0 +1,20 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import settings
+import catalog
+
+
+@pytest.fixture
+def tmp_catalog(tmp_path, monkeypatch):
+    '''使用临时目录中的备份目录(catalog), 替换进程内共享的实例'''
+    monkeypatch.setattr(settings, "CATALOG_FILE", str(tmp_path / "catalog.db"))
+    monkeypatch.setattr(catalog, "_catalog", None)
+    backups = catalog.get_catalog()
+    yield backups
+    backups.close()
@@ -0,0 +1,39 @@
+import asyncio
+from collections import namedtuple
+
+import pytest
+
+pytest.importorskip("paramiko")
+
+from async_remote import AsyncRemoteEngine
+from utils.declare import RunResult
+
+Server = namedtuple("Server", ["host"])
+
+
+def test_sinks_factory_called_after_slot_acquired(monkeypatch):
+    '''排队的任务不能提前打开sink'''
+    engine = AsyncRemoteEngine(global_limit=2, host_limit=1)
+    state = {"open": 0, "max_open": 0}
+
+    async def exec_stream(server, command, sinks, *args):
+        assert isinstance(sinks, list)
+        await asyncio.sleep(0.01)
+        state["open"] -= 1
+        return RunResult(status=True, msg="", returncodes=[0], bytes=0, elapsed=0.01)
+
+    def open_sinks():
+        state["open"] += 1
+        state["max_open"] = max(state["max_open"], state["open"])
+        return []
+
+    monkeypatch.setattr(engine, "_exec_stream", exec_stream)
+
+    async def main():
+        servers = [Server("10.0.0.1"), Server("10.0.0.2"), Server("10.0.0.3")]
+        jobs = [engine.exec_stream(server, "pg_dump", open_sinks) for server in servers for _ in range(10)]
+        return await asyncio.gather(*jobs)
+
+    results = asyncio.run(main())
+    assert all(result.status for result in results)
+    assert state["max_open"] == 2
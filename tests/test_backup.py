@@ -0,0 +1,102 @@
+import os
+import gzip
+
+import pytest
+
+pytest.importorskip("paramiko")
+
+import settings
+from backup import LocalBackup
+
+
+@pytest.fixture
+def local_backup(tmp_path, monkeypatch):
+    '''在临时目录中创建LocalBackup, query返回预先设置的结果'''
+    monkeypatch.chdir(tmp_path)
+
+    def make(dbs, results):
+        backup = LocalBackup("127.0.0.1", 5432, dbs)
+        queries = []
+
+        def query(db, sql, snapshot=None):
+            queries.append((db, sql))
+            return next((rows for key, rows in results.items() if key in sql), None)
+
+        monkeypatch.setattr(backup, "query", query)
+        backup.queries = queries
+        return backup
+
+    return make
+
+
+def test_get_db_sizes_accepts_set(local_backup):
+    '''GUI传入的dbs是set'''
+    backup = local_backup({"push", "rtp"}, {"pg_database_size": [["push", "10"], ["rtp", "20"], ["other", "30"]]})
+    assert backup.get_db_sizes() == {"push": 10, "rtp": 20}
+    assert backup.queries[0][0] in {"push", "rtp"}
+
+
+def test_tables_data_backup_fails_when_table_list_fails(local_backup, tmp_path):
+    backup = local_backup(["db1"], {"relkind = 'S'": []})
+    manifest = tmp_path / "127.0.0.1" / "db1_data" / "manifest.json"
+    manifest.parent.mkdir(parents=True)
+    manifest.write_text('{"tables": []}')
+    assert backup.tables_data_backup("db1") is False
+    assert manifest.read_text() == '{"tables": []}'
+
+
+@pytest.fixture
+def fake_bin(tmp_path, monkeypatch):
+    '''在PATH的最前面安装sh脚本形式的命令替身'''
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+
+    def install(program, body):
+        script = bin_dir / program
+        script.write_text(f"#!/bin/sh\n{body}\n")
+        script.chmod(0o755)
+
+    return install
+
+
+@pytest.fixture
+def fake_pg_dump(fake_bin):
+    '''输出部分数据后以退出码1结束的pg_dump'''
+    fake_bin("pg_dump", "echo 'partial dump'\necho 'pg_dump: error: connection lost' >&2\nexit 1")
+
+
+@pytest.mark.skipif(os.name != "posix", reason="pg_dump替身是sh脚本")
+@pytest.mark.parametrize("method, name", [
+    ("single_db_data_backup", "db1_data.sql"),
+    ("single_db_struct_backup", "db1_struct.sql"),
+])
+def test_failed_dump_keeps_previous_backup(local_backup, fake_pg_dump, tmp_catalog, tmp_path, monkeypatch,
+                                           method, name):
+    monkeypatch.setattr(settings, "BK_DATA_SPLIT_TABLES", False)
+    backup = local_backup(["db1"], {"server_version": [["16.2"]]})
+    file = tmp_path / "127.0.0.1" / name
+    file.write_text("previous good backup\n")
+    result = getattr(backup, method)("db1")
+    assert not result.status
+    assert file.read_text() == "previous good backup\n"
+    assert not os.path.exists(f"{file}.part")
+
+
+@pytest.mark.skipif(os.name != "posix", reason="命令替身是sh脚本")
+def test_restore_test_fails_on_sql_errors(local_backup, fake_bin, tmp_catalog, tmp_path):
+    '''psql出错后默认继续执行并以0退出, 恢复测试需要使用ON_ERROR_STOP'''
+    fake_bin("createdb", "exit 0")
+    fake_bin("dropdb", "exit 0")
+    # 与psql一样, 只有设置了ON_ERROR_STOP时SQL错误才会使退出码不为0
+    fake_bin("psql", 'cat > /dev/null\necho "ERROR:  relation does not exist" >&2\n'
+                     'case "$*" in *ON_ERROR_STOP=1*) exit 3;; esac')
+    backup = local_backup(["db1"], {})
+    file = tmp_path / "127.0.0.1" / "db1.gz"
+    with gzip.open(file, "wb") as f:
+        f.write(b"insert into missing values (1);\n")
+    tmp_catalog.record("127.0.0.1", "db1", "full", True, "2026-01-01 00:00:00", fmt="gzip", path=str(file))
+
+    status = backup.restore_test("db1")
+    assert not status.status
+    assert "ERROR" in status.msg
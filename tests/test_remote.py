@@ -0,0 +1,54 @@
+import pytest
+
+pytest.importorskip("paramiko")
+
+from remote import poll_channel
+from utils.runner import StderrTail
+
+
+class FakeChannel:
+    '''不断有数据到达的通道: 每次recv之后又有新数据'''
+
+    def __init__(self, stdout_chunks=None, stderr_chunks=None, eof=False):
+        self.stdout = list(stdout_chunks or [])
+        self.stderr = list(stderr_chunks or [])
+        self.eof_received = eof
+        self.closed = False
+        self.endless = stdout_chunks is None
+
+    def recv_ready(self):
+        return self.endless or bool(self.stdout)
+
+    def recv(self, size):
+        return b"x" * size if self.endless else self.stdout.pop(0)[:size]
+
+    def recv_stderr_ready(self):
+        return bool(self.stderr)
+
+    def recv_stderr(self, size):
+        return self.stderr.pop(0)
+
+
+def test_poll_channel_stops_at_limit():
+    channel = FakeChannel(stderr_chunks=[b"warning 1\n", b"warning 2\n"])
+    tail = StderrTail()
+    chunks, done = poll_channel(channel, tail, 1000, limit=4500)
+    assert sum(map(len, chunks)) == 4500
+    assert not done
+    # stderr在同一个循环中读取
+    tail.close()
+    assert tail.text("utf-8") == "warning 1\nwarning 2"
+
+
+def test_poll_channel_done_after_eof_and_drained():
+    channel = FakeChannel([b"a" * 10, b"b" * 10], [b"err\n"], eof=True)
+    tail = StderrTail()
+    chunks, done = poll_channel(channel, tail, 1000)
+    assert chunks == [b"a" * 10, b"b" * 10]
+    assert done
+
+
+def test_poll_channel_not_done_before_eof():
+    chunks, done = poll_channel(FakeChannel([b"a"]), StderrTail(), 1000)
+    assert chunks == [b"a"]
+    assert not done
@@ -0,0 +1,103 @@
+import datetime
+
+from retention import GfsPolicy, RetentionEngine, gfs_keep
+
+START = datetime.datetime(2026, 1, 1, 2, 0)
+
+
+def day(n):
+    return START + datetime.timedelta(days=n)
+
+
+def record(backups, n, path, status=True, artifacts=None, bytes=100, db="db1", mode="full"):
+    return backups.record("127.0.0.1", db, mode, status, day(n), day(n), fmt="sql", compressed_bytes=bytes,
+                          path=path, artifacts=artifacts)
+
+
+def test_gfs_keep_last_and_daily():
+    backups = [(10 - i, (START - datetime.timedelta(hours=12 * i)).isoformat(sep=" ")) for i in range(10)]
+    assert gfs_keep(backups, GfsPolicy(last=2, daily=0, weekly=0, monthly=0, yearly=0)) == {10, 9}
+    # 第一天只有02:00的备份, 之后每天14:00和02:00各一个, 每天只保留最新的一个
+    assert gfs_keep(backups, GfsPolicy(last=0, daily=3, weekly=0, monthly=0, yearly=0)) == {10, 9, 7}
+
+
+def test_gfs_keep_weekly_monthly_yearly():
+    days = [datetime.date(2026, 3, 31) - datetime.timedelta(days=i) for i in range(120)]
+    backups = [(i, f"{value} 02:00:00") for i, value in enumerate(days)]
+    weekly = gfs_keep(backups, GfsPolicy(last=0, daily=0, weekly=2, monthly=0, yearly=0))
+    # 2026-03-31是周二, 上一周最新的是周日03-29
+    assert weekly == {0, 2}
+    monthly = gfs_keep(backups, GfsPolicy(last=0, daily=0, weekly=0, monthly=3, yearly=0))
+    assert sorted(days[i].isoformat() for i in monthly) == ["2026-01-31", "2026-02-28", "2026-03-31"]
+    # 最早的备份是2025-12-02, 2025年最新的是12-31
+    assert gfs_keep(backups, GfsPolicy(last=0, daily=0, weekly=0, monthly=0, yearly=5)) == {0, 90}
+
+
+def test_plan_prunes_old_backups(tmp_catalog):
+    ids = [record(tmp_catalog, n, f"/bk/db1_{n}.sql.gz") for n in range(5)]
+    prune, files, kept, freed = RetentionEngine(GfsPolicy(2, 0, 0, 0, 0)).plan()
+    assert kept == 2
+    assert set(prune) == set(ids[:3])
+    assert files == [f"/bk/db1_{n}.sql.gz" for n in (2, 1, 0)]
+    assert freed == 300
+
+
+def test_plan_groups_by_host_db_mode(tmp_catalog):
+    record(tmp_catalog, 0, "/bk/db1.sql.gz")
+    record(tmp_catalog, 0, "/bk/db2.sql.gz", db="db2")
+    record(tmp_catalog, 0, "/bk/db1_data.sql", mode="data")
+    prune, files, kept, _ = RetentionEngine(GfsPolicy(1, 0, 0, 0, 0)).plan()
+    assert (prune, files, kept) == ({}, [], 3)
+
+
+def test_plan_superseded_rows_keep_files(tmp_catalog):
+    '''被同一路径的新备份覆盖的记录只标记, 文件属于新备份'''
+    old = record(tmp_catalog, 0, "/bk/db1.sql.gz")
+    record(tmp_catalog, 1, "/bk/db1.sql.gz")
+    prune, files, kept, freed = RetentionEngine(GfsPolicy(1, 0, 0, 0, 0)).plan()
+    assert prune == {old: []}
+    assert (files, kept, freed) == ([], 1, 0)
+
+
+def test_plan_failed_row_sharing_kept_path(tmp_catalog):
+    '''失败的备份不会覆盖旧记录, 与保留的备份路径相同时不能删除该文件'''
+    kept_id = record(tmp_catalog, 0, "/bk/db1.sql.gz")
+    failed = record(tmp_catalog, 1, "/bk/db1.sql.gz", status=False)
+    prune, files, kept, _ = RetentionEngine(GfsPolicy(1, 0, 0, 0, 0)).plan()
+    assert kept_id not in prune
+    assert failed in prune
+    assert kept == 1
+    assert files == []
+
+
+def test_plan_artifacts_shared_with_incremental_manifest(tmp_catalog):
+    '''按表增量备份复用了旧文件, 保留的清单引用的文件不能删除'''
+    out_dir = "/bk/db1_data"
+    old = record(tmp_catalog, 0, f"{out_dir}/manifest_0.json", mode="data",
+                 artifacts=[f"{out_dir}/manifest_0.json", f"{out_dir}/public.a_data.sql",
+                            f"{out_dir}/public.b_data.sql"])
+    record(tmp_catalog, 1, f"{out_dir}/manifest_1.json", mode="data",
+           artifacts=[f"{out_dir}/manifest_1.json", f"{out_dir}/public.a_data.sql",
+                      f"{out_dir}/public.b_data_1.sql"])
+    prune, files, kept, _ = RetentionEngine(GfsPolicy(1, 0, 0, 0, 0)).plan()
+    assert list(prune) == [old]
+    assert kept == 1
+    assert files == [f"{out_dir}/manifest_0.json", f"{out_dir}/public.b_data.sql"]
+
+
+def test_run_deletes_files_and_marks_pruned(tmp_catalog, tmp_path):
+    files = []
+    for n in range(3):
+        file = tmp_path / f"db1_{n}.sql.gz"
+        file.write_bytes(b"x")
+        files.append(file)
+        record(tmp_catalog, n, str(file))
+    engine = RetentionEngine(GfsPolicy(1, 0, 0, 0, 0), workers=2, batch_size=1)
+    report = engine.run(dry_run=True)
+    assert (report["pruned"], report["files"]) == (2, 2)
+    assert all(file.exists() for file in files)
+
+    report = engine.run(dry_run=False)
+    assert (report["pruned"], report["files"], report["failed"]) == (2, 2, [])
+    assert [file.exists() for file in files] == [False, False, True]
+    assert engine.plan() == ({}, [], 1, 0)
@@ -0,0 +1,117 @@
+import gzip
+import hashlib
+import os
+import sys
+
+from utils.runner import BufferSink, FileSink, HashSink, StderrTail, iter_file, run_pipeline
+
+PYTHON = sys.executable
+
+
+def python(code):
+    return [PYTHON, "-c", code]
+
+
+CAT = python("import shutil, sys; shutil.copyfileobj(sys.stdin.buffer, sys.stdout.buffer)")
+
+
+class ClosingSink(BufferSink):
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_streams_output_to_all_sinks(tmp_path):
+    data = os.urandom(3 * 1024 * 1024 + 17)
+    source_file = tmp_path / "source"
+    source_file.write_bytes(data)
+    target = tmp_path / "target"
+    file_sink, hasher, buffer = FileSink(str(target)), HashSink("sha256"), ClosingSink()
+
+    result = run_pipeline([CAT], sinks=[file_sink, hasher, buffer], source=iter_file(str(source_file)),
+                          chunk_size=64 * 1024)
+    assert result.status
+    assert result.returncodes == [0]
+    assert result.bytes == len(data) == file_sink.bytes_out == hasher.bytes
+    assert target.read_bytes() == data
+    assert hasher.hexdigest() == hashlib.sha256(data).hexdigest()
+    assert buffer.closed
+
+
+def test_pipeline_connects_commands():
+    upper = python("import sys; sys.stdout.write(sys.stdin.read().upper())")
+    buffer = BufferSink()
+    result = run_pipeline([python("print('a' * 10)"), CAT, upper], sinks=[buffer])
+    assert result.status
+    assert result.returncodes == [0, 0, 0]
+    assert buffer.getvalue().strip() == b"A" * 10
+    # 不支持wait4的系统(Windows)不记录资源使用
+    if hasattr(os, "wait4"):
+        assert [usage.program for usage in result.usage] == [os.path.basename(PYTHON)] * 3
+
+
+def test_failed_command_fails_pipeline_with_stderr_tail():
+    failing = python("import sys\nfor i in range(100): print(f'line {i}', file=sys.stderr)\nsys.exit(3)")
+    result = run_pipeline([failing, CAT], sinks=[BufferSink()], tail_lines=5)
+    assert not result.status
+    assert result.returncodes == [3, 0]
+    assert result.msg.splitlines() == [f"line {i}" for i in range(95, 100)]
+
+
+def test_failure_without_stderr_reports_returncodes():
+    result = run_pipeline([python("raise SystemExit(2)")])
+    assert not result.status
+    assert "[2]" in result.msg
+
+
+def test_shell_string_command():
+    buffer = BufferSink()
+    result = run_pipeline([f'"{PYTHON}" -c "print(42)"'], sinks=[buffer])
+    assert result.status
+    assert buffer.getvalue().strip() == b"42"
+
+
+def test_downstream_exit_does_not_fail_source():
+    '''下游只读取部分输入就正常退出时, 以下游的退出码为准'''
+    source = (b"x" * 65536 for _ in range(1000))
+    result = run_pipeline([python("import sys; sys.stdin.buffer.read(10)")], source=source)
+    assert result.status
+
+
+def test_source_error_fails_pipeline():
+    def source():
+        yield b"partial data\n"
+        raise OSError("disk read error")
+
+    buffer = BufferSink()
+    result = run_pipeline([CAT], sinks=[buffer], source=source())
+    assert not result.status
+    assert "OSError: disk read error" in result.msg
+
+
+def test_truncated_gzip_source_fails_pipeline(tmp_path):
+    file = tmp_path / "dump.sql.gz"
+    with gzip.open(file, "wb") as f:
+        f.write(os.urandom(512 * 1024))
+    file.write_bytes(file.read_bytes()[:300 * 1024])
+
+    def source():
+        with gzip.open(file, "rb") as f:
+            while True:
+                chunk = f.read(64 * 1024)
+                if not chunk:
+                    break
+                yield chunk
+
+    result = run_pipeline([CAT], sinks=[BufferSink()], source=source())
+    assert not result.status
+    assert "EOFError" in result.msg
+
+
+def test_stderr_tail_keeps_last_lines_and_partial_line():
+    tail = StderrTail(maxlen=2)
+    for chunk in (b"one\ntw", b"o\nthree\nfo", b"ur"):
+        tail.write(chunk)
+    tail.close()
+    assert tail.text("utf-8") == "three\nfour"
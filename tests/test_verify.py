@@ -0,0 +1,31 @@
+import gzip
+import json
+
+from utils.checksum import sidecar_path
+from verify import IntegrityScanner, verify_file
+
+
+def test_verify_file_missing_artifact(tmp_path):
+    file = tmp_path / "gone.dump"
+    with open(sidecar_path(str(file)), "w") as f:
+        json.dump({"algorithm": "sha256", "digest": "0" * 64, "bytes": 1}, f)
+    report = verify_file(str(file))
+    assert not report["status"]
+    assert "文件不存在" in report["error"]
+    assert report["file_bytes"] == 0
+
+
+def test_scanner_reports_missing_and_corrupt_files(tmp_path):
+    good, bad = tmp_path / "good.sql.gz", tmp_path / "bad.sql.gz"
+    with gzip.open(good, "wb") as f:
+        f.write(b"insert into t values (1);\n" * 1000)
+    bad.write_bytes(good.read_bytes()[:100])
+    with open(sidecar_path(str(tmp_path / "gone.dump")), "w") as f:
+        json.dump({"algorithm": "sha256", "digest": "0" * 64, "bytes": 1}, f)
+
+    report = IntegrityScanner(str(tmp_path), workers=2).run()
+    assert report["files"] == 3
+    assert report["failed"] == 2
+    failed = [result["file"] for result in report["results"] if not result["status"]]
+    assert failed == [str(bad), str(tmp_path / "gone.dump")]
+    assert (tmp_path / "integrity_report.json").exists()
@@ -0,0 +1,131 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from core import get_logger
+from utils.declare import Status
+from utils.runner import BufferSink
+import settings
+
+logger = get_logger()
+
+
+class SftpDownloader:
+    '''通过SFTP并发, 可续传地下载远程服务器上的备份文件
+
+    大文件按range_size划分为多个范围, 在多个SFTP通道上同时下载, 写入{file}.part.
+    每完成一个范围, 校验其sha256与远程计算的结果一致后记录到{file}.journal,
+    中断后再次下载时只下载journal中没有记录的范围.
+    '''
+
+    def __init__(self, server, threads=None, range_size=None):
+        self._server = server
+        self._threads = threads or settings.SFTP_THREAD_NUM
+        self._range_size = range_size or settings.SFTP_RANGE_SIZE
+        self._lock = threading.Lock()
+
+    def download(self, remote_path, local_path):
+        '''下载单个文件, 返回Status, 成功时msg为下载的字节数'''
+        start = time.time()
+        with self._server.sftp() as sftp:
+            stat = sftp.stat(remote_path)
+        size, mtime = stat.st_size, stat.st_mtime
+
+        part_path, journal_path = f"{local_path}.part", f"{local_path}.journal"
+        journal = self._load_journal(journal_path)
+        if not journal or journal["size"] != size or journal["mtime"] != mtime or not os.path.exists(part_path):
+            # 远程文件已变化或没有下载记录, 重新下载
+            journal = {"remote_path": remote_path, "size": size, "mtime": mtime, "range_size": self._range_size,
+                       "ranges": {}}
+            with open(part_path, "wb") as f:
+                f.truncate(size)
+        range_size = journal["range_size"]
+
+        offsets = [offset for offset in range(0, size, range_size) if str(offset) not in journal["ranges"]]
+        if len(offsets) < -(-size // range_size):
+            logger.info(f"续传文件[{remote_path}], 剩余{len(offsets)}个范围")
+
+        errors = []
+        with ThreadPoolExecutor(max_workers=self._threads) as executor:
+            tasks = [executor.submit(self._fetch_range, remote_path, part_path, offset,
+                                     min(range_size, size - offset), journal, journal_path) for offset in offsets]
+            for task in tasks:
+                if task.exception():
+                    errors.append(str(task.exception()))
+        if errors:
+            return Status(status=False, msg=f"下载文件[{remote_path}]失败: {errors[0]}")
+
+        os.replace(part_path, local_path)
+        if os.path.exists(journal_path):
+            os.remove(journal_path)
+        fetched = sum(min(range_size, size - offset) for offset in offsets)
+        elapsed = time.time() - start
+        speed = fetched / 1024 / 1024 / elapsed if elapsed else 0.0
+        logger.info(f"下载文件[{remote_path}]完成, 大小:{size}字节, 本次下载:{fetched}字节, "
+                    f"耗时:{elapsed:.1f}秒, 速度:{speed:.1f}MB/s")
+        return Status(status=True, msg=fetched)
+
+    def _fetch_range(self, remote_path, part_path, offset, length, journal, journal_path):
+        sha256 = hashlib.sha256()
+        chunk = settings.STREAM_CHUNK_SIZE
+        requests = [(pos, min(chunk, offset + length - pos)) for pos in range(offset, offset + length, chunk)]
+        with self._server.sftp() as sftp, sftp.open(remote_path, "rb") as remote_file, open(part_path, "r+b") as f:
+            f.seek(offset)
+            # readv会以流水线方式同时发出多个读请求
+            for data in remote_file.readv(requests):
+                sha256.update(data)
+                f.write(data)
+
+        digest = sha256.hexdigest()
+        remote_digest = self._remote_digest(remote_path, offset, length)
+        if digest != remote_digest:
+            raise RuntimeError(f"范围[{offset}, {offset + length})校验失败, 本地:{digest}, 远程:{remote_digest}")
+
+        with self._lock:
+            journal["ranges"][str(offset)] = digest
+            tmp_path = f"{journal_path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(journal, f)
+            os.replace(tmp_path, journal_path)
+
+    def _remote_digest(self, remote_path, offset, length):
+        buffer = BufferSink()
+        cmd = f"tail -c +{offset + 1} {remote_path} | head -c {length} | sha256sum"
+        result = self._server.exec_stream(cmd, sinks=[buffer])
+        if not result.status:
+            raise RuntimeError(result.msg)
+        return buffer.getvalue().decode().split()[0]
+
+    @staticmethod
+    def _load_journal(journal_path):
+        if not os.path.exists(journal_path):
+            return None
+        try:
+            with open(journal_path, "r") as f:
+                return json.load(f)
+        except ValueError:
+            return None
+
+    def download_files(self, files):
+        '''依次下载多个文件, files为[(remote_path, local_path)], 返回失败的文件列表'''
+        start = time.time()
+        failed, total = [], 0
+        for remote_path, local_path in files:
+            try:
+                result = self.download(remote_path, local_path)
+            except Exception as e:
+                # 远程文件不存在, 连接断开或本地写入失败只影响这一个文件
+                result = Status(status=False, msg=f"下载文件[{remote_path}]失败: {type(e).__name__}: {e}")
+            if not result.status:
+                logger.error(result.msg)
+                failed.append(remote_path)
+            else:
+                total += result.msg
+        elapsed = time.time() - start
+        speed = total / 1024 / 1024 / elapsed if elapsed else 0.0
+        logger.info(f"主机[{self._server.host}]下载完成, 共{len(files)}个文件, 失败{len(failed)}个, 下载:{total}字节, "
+                    f"耗时:{elapsed:.1f}秒, 速度:{speed:.1f}MB/s")
+        return failed
@@ -0,0 +1,61 @@
+import os
+import json
+import hashlib
+
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+import settings
+
+SIDECAR_SUFFIX = ".checksum"
+XXHASH_ALGORITHMS = ("xxh64", "xxh3_64", "xxh3_128")
+
+
+def new_hash(algorithm=None):
+    '''创建摘要对象, 支持hashlib中的算法, blake3和xxhash(需要安装对应的模块)'''
+    algorithm = algorithm or settings.CHECKSUM_ALGORITHM
+    if algorithm == "blake3":
+        if blake3 is None:
+            raise RuntimeError("使用blake3摘要需要安装blake3模块")
+        return blake3.blake3()
+    if algorithm in XXHASH_ALGORITHMS:
+        if xxhash is None:
+            raise RuntimeError("使用xxhash摘要需要安装xxhash模块")
+        return getattr(xxhash, algorithm)()
+    return hashlib.new(algorithm)
+
+
+def sidecar_path(path):
+    return f"{path}{SIDECAR_SUFFIX}"
+
+
+def write_sidecar(path, algorithm, digest, nbytes, scope="content"):
+    '''将备份文件的摘要写入旁路文件{path}.checksum, 返回"算法:摘要"
+
+    scope为content时摘要是压缩前的数据流, 为file时是文件本身的内容.
+    '''
+    record = {"algorithm": algorithm, "digest": digest, "bytes": nbytes, "scope": scope}
+    tmp_path = f"{sidecar_path(path)}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(record, f)
+    os.replace(tmp_path, sidecar_path(path))
+    return f"{algorithm}:{digest}"
+
+
+def read_sidecar(path):
+    '''读取备份文件的旁路摘要, 不存在或损坏时返回None'''
+    file = sidecar_path(path)
+    if not os.path.exists(file):
+        return None
+    try:
+        with open(file, "r") as f:
+            return json.load(f)
+    except ValueError:
+        return None
@@ -1,26 +1,19 @@
 import os
-import subprocess
-import tempfile
 import getpass
 
 from remote import RemoteServer
 from utils.declare import Status
+from utils.runner import run_pipeline, BufferSink
 import settings
 
 
 def exec_command(cmd):
     '''执行shell命令'''
-    stderr_temp = tempfile.TemporaryFile()
-    stdout_temp = tempfile.TemporaryFile()
-    result = subprocess.Popen(cmd, stdout=stdout_temp.fileno(), stderr=stderr_temp.fileno(), shell=True)
-    result.wait()
-
-    stderr_temp.seek(0)
-    stderr = stderr_temp.read()
-    if stderr:
-        return Status(status=False, msg=stderr.decode("gbk"))
-    stdout_temp.seek(0)
-    return Status(status=True, msg=stdout_temp.read().decode("gbk"))
+    buffer = BufferSink()
+    result = run_pipeline([cmd], sinks=[buffer])
+    if not result.status:
+        return Status(status=False, msg=result.msg)
+    return Status(status=True, msg=buffer.getvalue().decode(settings.CMD_ENCODING, errors="replace"))
 
 
 def set_remote_server(host, port, user, password):
@@ -30,6 +23,11 @@ def set_remote_server(host, port, user, password):
     settings.REMOTE_PASSWORD = password
 
 
+def get_remote_server():
+    '''获取远程服务器, 连接由连接池复用'''
+    return RemoteServer(settings.REMOTE_HOST, settings.REMOTE_PORT, settings.REMOTE_USER, settings.REMOTE_PASSWORD)
+
+
 def check_remote_server():
     '''检查远程服务器配置'''
     if not settings.REMOTE_HOST or settings.REMOTE_HOST in ("localhost", "127.0.0.1"):
@@ -53,10 +51,19 @@ def check_pgpass(pgpass):
     return Status(status=True, msg="检查通过")
 
 
+def get_local_pgpass_file():
+    '''本地pgpass文件的路径'''
+    if settings.LOCAL_PGPASS_FILE:
+        return settings.LOCAL_PGPASS_FILE
+    if os.environ.get("PGPASSFILE"):
+        return os.environ["PGPASSFILE"]
+    user = getpass.getuser()
+    return f"C:/Users/{user}/AppData/Roaming/postgresql/pgpass.conf"
+
+
 def get_local_pgpass():
     '''读取本地的pgpass记录'''
-    user = getpass.getuser()
-    file = f"C:/Users/{user}/AppData/Roaming/postgresql/pgpass.conf"
+    file = get_local_pgpass_file()
     if not os.path.exists(file):
         return Status(status=False, msg="pgpass文件不存在!")
 
@@ -66,8 +73,7 @@ def get_local_pgpass():
 
 def save_local_pgpass(records):
     '''写入记录到本地的pgpass文件'''
-    user = getpass.getuser()
-    file = f"C:/Users/{user}/AppData/Roaming/postgresql/pgpass.conf"
+    file = get_local_pgpass_file()
 
     # 添加pgpass记录
     with open(file, "w") as f:
@@ -108,9 +114,7 @@ def remove_local_pgpass(pgpass):
     records = set(result.msg.split("\n"))
     if pgpass in records:
         records.remove(pgpass)
-        user = getpass.getuser()
-        file = f"C:/Users/{user}/AppData/Roaming/postgresql/pgpass.conf"
-        with open(file, "w") as f:
+        with open(get_local_pgpass_file(), "w") as f:
             for record in records:
                 f.write(f"{record}\n")
         return Status(status=True, msg="删除记录成功.")
@@ -124,7 +128,7 @@ def get_remote_pgpass():
     if not result.status:
         return result
 
-    server = RemoteServer(settings.REMOTE_HOST, settings.REMOTE_PORT, settings.REMOTE_USER, settings.REMOTE_PASSWORD)
+    server = get_remote_server()
     result = server.exec_command("cat .pgpass")
     return Status(status=result.status, msg=result.msg)
 
@@ -135,7 +139,7 @@ def save_remote_pgpass(records):
     if not result.status:
         return result
 
-    server = RemoteServer(settings.REMOTE_HOST, settings.REMOTE_PORT, settings.REMOTE_USER, settings.REMOTE_PASSWORD)
+    server = get_remote_server()
     content = "\n".join(records)
     result = server.exec_command(f"echo '{content}' > .pgpass")
     if not result.status:
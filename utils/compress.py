@@ -0,0 +1,172 @@
+import os
+import gzip
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+import settings
+
+CODEC_SUFFIX = {"gzip": ".gz", "zstd": ".zst", "lz4": ".lz4"}
+DEFAULT_LEVEL = {"gzip": 6, "zstd": 3, "lz4": 0}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    '''所有压缩任务共享的线程池, zlib/zstd/lz4在压缩时会释放GIL'''
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.BK_COMPRESS_THREADS)
+        return _executor
+
+
+def _reset_executor():
+    '''fork出的子进程中没有线程池的工作线程, 需要重新创建'''
+    global _executor, _executor_lock
+    _executor = None
+    _executor_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_executor)
+
+
+def check_codec(codec):
+    '''检查压缩算法是否可用'''
+    if codec not in CODEC_SUFFIX:
+        raise ValueError(f"不支持的压缩算法:{codec}")
+    if codec == "zstd" and zstandard is None:
+        raise RuntimeError("使用zstd压缩需要安装zstandard模块")
+    if codec == "lz4" and lz4 is None:
+        raise RuntimeError("使用lz4压缩需要安装lz4模块")
+
+
+def get_codec(path):
+    '''根据文件后缀获取压缩算法'''
+    for codec, suffix in CODEC_SUFFIX.items():
+        if path.endswith(suffix):
+            return codec
+    return None
+
+
+def compress_block(codec, level, block):
+    '''压缩一个独立的数据块, 每块都是一个完整的gzip member/zstd frame/lz4 frame'''
+    if codec == "gzip":
+        return gzip.compress(block, compresslevel=level, mtime=0)
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=level).compress(block)
+    return lz4.frame.compress(block, compression_level=level)
+
+
+def decompress_block(codec, data):
+    '''解压compress_block压缩的数据块'''
+    if codec == "gzip":
+        return gzip.decompress(data)
+    if codec == "zstd":
+        return zstandard.ZstdDecompressor().decompress(data)
+    return lz4.frame.decompress(data)
+
+
+class CompressSink:
+    '''分块并行压缩并按顺序写入文件
+
+    gzip模式下输出为多member的gzip文件, gunzip可以直接解压.
+    compress_time和write_time是写出时等待压缩结果和写文件的时间.
+    '''
+
+    def __init__(self, path, codec=None, level=None, block_size=None):
+        self.codec = codec or settings.BK_COMPRESS_CODEC
+        check_codec(self.codec)
+        self.level = DEFAULT_LEVEL[self.codec] if level is None else level
+        self.path = path
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.compress_time = 0.0
+        self.write_time = 0.0
+        self._block_size = block_size or settings.BK_COMPRESS_BLOCK_SIZE
+        self._max_pending = settings.BK_COMPRESS_THREADS * 2
+        self._buffer = bytearray()
+        self._pending = deque()
+        self._file = open(path, "wb")
+        self._start = time.time()
+        self._elapsed = None
+
+    def write(self, chunk):
+        self._buffer += chunk
+        while len(self._buffer) >= self._block_size:
+            block = bytes(self._buffer[:self._block_size])
+            del self._buffer[:self._block_size]
+            self._submit(block)
+
+    def _submit(self, block):
+        self.bytes_in += len(block)
+        self._pending.append(get_executor().submit(compress_block, self.codec, self.level, block))
+        # 限制未写入的块数, 保证内存占用有上限
+        while len(self._pending) > self._max_pending:
+            self._write_next()
+
+    def _write_next(self):
+        start = time.time()
+        data = self._pending.popleft().result()
+        written = time.time()
+        self._file.write(data)
+        self.write_time += time.time() - written
+        self.compress_time += written - start
+        self.bytes_out += len(data)
+
+    def close(self):
+        if self._file.closed:
+            return
+        try:
+            if self._buffer or not self.bytes_in:
+                self._submit(bytes(self._buffer))
+                self._buffer = bytearray()
+            while self._pending:
+                self._write_next()
+        finally:
+            self._file.close()
+            self._elapsed = time.time() - self._start
+
+    @property
+    def ratio(self):
+        return self.bytes_in / self.bytes_out if self.bytes_out else 0.0
+
+    @property
+    def speed(self):
+        '''压缩速度(MB/s)'''
+        elapsed = self._elapsed if self._elapsed is not None else time.time() - self._start
+        return self.bytes_in / 1024 / 1024 / elapsed if elapsed else 0.0
+
+
+def iter_decompress(path, chunk_size=None):
+    '''流式解压文件, 按块返回解压后的数据'''
+    chunk_size = chunk_size or settings.STREAM_CHUNK_SIZE
+    codec = get_codec(path)
+    check_codec(codec)
+    if codec == "gzip":
+        stream = gzip.open(path, "rb")
+    elif codec == "zstd":
+        stream = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), read_across_frames=True,
+                                                           closefd=True)
+    else:
+        stream = lz4.frame.open(path, "rb")
+
+    with stream:
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
@@ -1,3 +1,9 @@
 from collections import namedtuple
 
-Status = namedtuple("Status", ["status", "msg"])
\ No newline at end of file
+Status = namedtuple("Status", ["status", "msg"])
+RunResult = namedtuple("RunResult", ["status", "msg", "returncodes", "bytes", "elapsed", "retries", "usage"],
+                       defaults=(0, ()))
+# 子进程的资源使用: CPU时间(秒), 实际读写磁盘的字节数, 主动/被动上下文切换次数
+ProcessUsage = namedtuple("ProcessUsage", ["program", "pid", "user_time", "system_time", "read_bytes", "write_bytes",
+                                           "voluntary_switches", "involuntary_switches"])
+JobResult = namedtuple("JobResult", ["name", "status", "elapsed", "result"])
@@ -0,0 +1,133 @@
+import time
+import heapq
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from core import get_logger
+from utils.declare import JobResult
+import settings
+
+logger = get_logger()
+
+
+class WorkerBudget:
+    '''在同时运行的数据库之间分配pg_dump/pg_restore的-j并发数
+
+    每个数据库开始时按"剩余并发数 / 可同时运行的数据库数"领取份额,
+    结束后归还, 因此最后运行的大库可以拿到全部的CPU.
+    '''
+
+    def __init__(self, total, jobs_num, parallel):
+        self._free = max(1, total)
+        self._pending = jobs_num
+        self._parallel = max(1, parallel)
+        self._running = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            self._pending = max(0, self._pending - 1)
+            slots = max(1, min(self._parallel - self._running, self._pending + 1))
+            share = max(1, self._free // slots)
+            self._free -= share
+            self._running += 1
+            return share
+
+    def release(self, share):
+        with self._lock:
+            self._free += share
+            self._running -= 1
+
+
+class StepTimer:
+    '''记录任务中每个步骤的耗时'''
+
+    def __init__(self):
+        self.steps = []
+
+    @contextmanager
+    def step(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.steps.append((name, time.time() - start))
+
+    @property
+    def total(self):
+        return sum(elapsed for _, elapsed in self.steps)
+
+    def summary(self):
+        return ", ".join(f"{name}:{elapsed:.1f}秒" for name, elapsed in self.steps)
+
+
+def lpt_plan(sizes, workers):
+    '''最长处理时间优先(LPT)调度
+
+    任务按大小从大到小排列, 依次分配给当前负载最小的worker.
+    返回任务顺序以及计划的makespan(最忙的worker需要处理的字节数).
+    '''
+    order = sorted(sizes, key=lambda name: sizes[name], reverse=True)
+    loads = [0] * max(1, workers)
+    for name in order:
+        heapq.heappush(loads, heapq.heappop(loads) + sizes[name])
+    return order, max(loads)
+
+
+def run_jobs(func, names, workers, sizes=None, args=()):
+    '''并发执行func(name, *args)
+
+    给出sizes时按LPT顺序派发任务: 线程池总是把下一个任务交给最先空闲的线程,
+    因此按从大到小提交就等价于LPT调度. 返回按完成顺序排列的JobResult列表.
+    '''
+    names = list(names)
+    if sizes:
+        known = {name: sizes.get(name, 0) for name in names}
+        names, planned = lpt_plan(known, workers)
+        estimate = planned / 1024 / 1024 / settings.BK_EST_SPEED
+        logger.info(f"任务按大小从大到小派发: {names}, 计划makespan:{planned}字节(预计{estimate:.1f}秒)")
+
+    def run(name):
+        start = time.time()
+        result = func(name, *args)
+        return result, time.time() - start
+
+    start = time.time()
+    results = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        tasks = {executor.submit(run, name): name for name in names}
+        for task in as_completed(tasks):
+            name = tasks[task]
+            exception = task.exception()
+            if exception:
+                logger.error(exception)
+                results.append(JobResult(name=name, status=False, elapsed=0.0, result=exception))
+                continue
+            result, elapsed = task.result()
+            status = getattr(result, "status", result is not False)
+            results.append(JobResult(name=name, status=bool(status), elapsed=elapsed, result=result))
+    logger.info(f"实际makespan:{time.time() - start:.1f}秒")
+    return results
+
+
+def format_usage(usage):
+    '''将一个子进程的ProcessUsage格式化为一行文本'''
+    io = ""
+    if usage.read_bytes is not None:
+        io = f", 读磁盘:{usage.read_bytes / 1024 / 1024:.1f}MB, 写磁盘:{usage.write_bytes / 1024 / 1024:.1f}MB"
+    return (f"{usage.program}: CPU用户:{usage.user_time:.2f}秒, 系统:{usage.system_time:.2f}秒{io}, "
+            f"上下文切换(主动/被动):{usage.voluntary_switches}/{usage.involuntary_switches}")
+
+
+def log_summary(results, title):
+    '''按耗时从长到短输出每个任务的耗时汇总, 以及任务中每个子进程的资源使用'''
+    failed = [result.name for result in results if not result.status]
+    total = sum(result.elapsed for result in results)
+    logger.info(f"{title}汇总: 共{len(results)}个, 失败{len(failed)}个, 累计耗时:{total:.1f}秒")
+    for result in sorted(results, key=lambda result: result.elapsed, reverse=True):
+        state = "成功" if result.status else "失败"
+        logger.info(f"    {result.name}: {state}, 耗时:{result.elapsed:.2f}秒")
+        # CPU时间接近耗时说明是CPU瓶颈, 两者都远小于耗时说明在等待I/O或其他进程
+        for usage in getattr(result.result, "usage", ()):
+            logger.info(f"        {format_usage(usage)}")
@@ -0,0 +1,174 @@
+import os
+import json
+import time
+import datetime
+import threading
+from contextlib import contextmanager
+
+from core import get_logger
+import settings
+
+logger = get_logger()
+
+
+class JobMetrics:
+    '''一个备份任务的指标: 每个阶段的耗时, 输入/输出字节数, 退出状态和重试次数
+
+    数据以流的方式经过管道, 各阶段是重叠的: dump是命令从启动到结束的耗时, connect是从任务开始到收到
+    第一个字节的时间(包括导出快照和命令连接数据库), compress和write是写出线程等待压缩和写文件的时间,
+    所以各阶段的耗时不能相加. 对象本身可以作为run_pipeline/exec_stream的sink, 用于记录第一个字节的时间.
+    '''
+
+    def __init__(self, host, db, mode):
+        self.host = host
+        self.db = db
+        self.mode = mode
+        self.phases = {}
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.status = None
+        self.returncodes = None
+        self.retries = 0
+        self.usage = ()
+        self.started = time.time()
+        self.finished = None
+        self._first_byte = None
+
+    @contextmanager
+    def phase(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, time.time() - start)
+
+    def add(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def write(self, chunk):
+        if self._first_byte is None:
+            self._first_byte = time.time()
+
+    def close(self):
+        pass
+
+    def finish(self, result, sink=None, bytes_in=None, bytes_out=None):
+        '''根据命令的RunResult和写出备份的sink补全指标, 并交给导出器
+
+        sink有compress_time/write_time时记入compress/write阶段, bytes_in默认是命令输出的字节数,
+        bytes_out默认取sink的bytes_out.
+        '''
+        self.status = bool(result.status)
+        self.returncodes = result.returncodes
+        self.retries += result.retries
+        self.usage = result.usage
+        self.add("dump", result.elapsed)
+        if self._first_byte is not None:
+            self.add("connect", self._first_byte - self.started)
+        for name in ("compress", "write"):
+            seconds = getattr(sink, f"{name}_time", None)
+            if seconds is not None:
+                self.add(name, seconds)
+        self.bytes_in = result.bytes if bytes_in is None else bytes_in
+        self.bytes_out = getattr(sink, "bytes_out", 0) if bytes_out is None else bytes_out
+        self.finished = time.time()
+        get_exporter().add(self)
+        return self
+
+    @property
+    def throughput(self):
+        '''命令输出的速度(字节/秒)'''
+        dump = self.phases.get("dump")
+        return self.bytes_in / dump if dump else 0.0
+
+    def to_dict(self):
+        return {
+            "host": self.host,
+            "db": self.db,
+            "mode": self.mode,
+            "status": self.status,
+            "returncodes": self.returncodes,
+            "retries": self.retries,
+            "started": datetime.datetime.fromtimestamp(self.started).isoformat(),
+            "finished": datetime.datetime.fromtimestamp(self.finished).isoformat() if self.finished else None,
+            "phases": {name: round(seconds, 6) for name, seconds in self.phases.items()},
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "throughput": round(self.throughput, 1),
+            "processes": [usage._asdict() for usage in self.usage],
+        }
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# Prometheus指标: (名称, 说明, 取值函数), 阶段耗时单独处理
+PROM_METRICS = (
+    ("pg_backup_job_success", "备份任务是否成功", lambda metrics: int(bool(metrics.status))),
+    ("pg_backup_job_retries", "备份任务的重试次数", lambda metrics: metrics.retries),
+    ("pg_backup_job_bytes_in", "备份命令输出的字节数", lambda metrics: metrics.bytes_in),
+    ("pg_backup_job_bytes_out", "写入备份文件的字节数", lambda metrics: metrics.bytes_out),
+    ("pg_backup_job_throughput_bytes_per_second", "备份命令输出的速度", lambda metrics: metrics.throughput),
+    ("pg_backup_job_last_finished_timestamp_seconds", "备份任务结束的时间", lambda metrics: metrics.finished),
+)
+
+
+class MetricsExporter:
+    '''将备份任务的指标导出为JSON lines和Prometheus textfile
+
+    每个任务结束时向METRICS_JSONL_FILE追加一行, METRICS_PROM_FILE保存每个(host, db, mode)最近一次任务的指标,
+    先写临时文件再替换, node_exporter的textfile collector不会读到写了一半的文件.
+    导出失败只记录日志, 不影响备份本身.
+    '''
+
+    def __init__(self, jsonl_file=None, prom_file=None):
+        self._jsonl_file = jsonl_file
+        self._prom_file = prom_file
+        self._latest = {}
+        self._lock = threading.Lock()
+
+    def add(self, metrics):
+        with self._lock:
+            self._latest[(metrics.host, metrics.db, metrics.mode)] = metrics
+            try:
+                if self._jsonl_file:
+                    with open(self._jsonl_file, "a", encoding="utf-8") as f:
+                        f.write(json.dumps(metrics.to_dict(), ensure_ascii=False) + "\n")
+                if self._prom_file:
+                    self._write_prom()
+            except OSError as e:
+                logger.error(f"导出备份指标失败: {e}")
+
+    def _write_prom(self):
+        lines = []
+        jobs = [(f'host="{_label(m.host)}",db="{_label(m.db)}",mode="{_label(m.mode)}"', m)
+                for _, m in sorted(self._latest.items())]
+        lines.append("# HELP pg_backup_job_phase_seconds 备份任务各阶段的耗时(阶段之间重叠)")
+        lines.append("# TYPE pg_backup_job_phase_seconds gauge")
+        for labels, metrics in jobs:
+            for phase, seconds in metrics.phases.items():
+                lines.append(f'pg_backup_job_phase_seconds{{{labels},phase="{phase}"}} {seconds:.6f}')
+        for name, help_text, value in PROM_METRICS:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, metrics in jobs:
+                lines.append(f"{name}{{{labels}}} {value(metrics)}")
+
+        tmp_file = f"{self._prom_file}.{os.getpid()}.tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_file, self._prom_file)
+
+
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+def get_exporter():
+    '''进程内共享的指标导出器'''
+    global _exporter
+    with _exporter_lock:
+        if _exporter is None:
+            _exporter = MetricsExporter(settings.METRICS_JSONL_FILE, settings.METRICS_PROM_FILE)
+        return _exporter
@@ -0,0 +1,69 @@
+import os
+import time
+import tempfile
+import subprocess
+
+import settings
+
+
+class ExportedSnapshot:
+    '''在一个保持打开的psql会话中开启可重复读事务并导出快照
+
+    多个pg_dump --snapshot或SET TRANSACTION SNAPSHOT可以共享该快照, 得到一致的数据.
+    快照在退出上下文(提交事务)后失效.
+    psql的标准输出在管道中可能被缓冲, 所以快照id通过\\o写入临时文件读取.
+    '''
+
+    def __init__(self, psql_cmd, timeout=None):
+        self._cmd = list(psql_cmd)
+        self._timeout = timeout or settings.SNAPSHOT_TIMEOUT
+        self._proc = None
+        self.snapshot_id = None
+
+    def __enter__(self):
+        fd, path = tempfile.mkstemp(suffix=".snapshot")
+        os.close(fd)
+        try:
+            cmd = self._cmd[:1] + ["-X", "-q", "-A", "-t", "-v", "ON_ERROR_STOP=1"] + self._cmd[1:]
+            self._proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            psql_path = path.replace(os.sep, "/")
+            script = "BEGIN ISOLATION LEVEL REPEATABLE READ READ ONLY;\n" \
+                     f"\\o '{psql_path}'\n" \
+                     "SELECT pg_export_snapshot();\n" \
+                     "\\o\n"
+            self._proc.stdin.write(script.encode())
+            self._proc.stdin.flush()
+            self.snapshot_id = self._wait_snapshot(path)
+        except BaseException:
+            self.close()
+            raise
+        finally:
+            os.remove(path)
+        return self
+
+    def _wait_snapshot(self, path):
+        deadline = time.time() + self._timeout
+        while time.time() < deadline:
+            with open(path, "r") as f:
+                content = f.read()
+            if content.endswith("\n"):
+                return content.strip()
+            if self._proc.poll() is not None:
+                err = self._proc.stderr.read().decode(settings.CMD_ENCODING, errors="replace").strip()
+                raise RuntimeError(f"导出快照失败: {err}")
+            time.sleep(0.05)
+        raise RuntimeError(f"导出快照超时({self._timeout}秒)")
+
+    def close(self):
+        if self._proc is None or self._proc.poll() is not None:
+            return
+        try:
+            self._proc.stdin.write(b"COMMIT;\n")
+            self._proc.stdin.close()
+            self._proc.wait(timeout=self._timeout)
+        except (OSError, subprocess.TimeoutExpired):
+            self._proc.kill()
+            self._proc.wait()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,313 @@
+import os
+import time
+import subprocess
+import threading
+from collections import deque
+
+from utils.declare import RunResult, ProcessUsage
+from utils.checksum import new_hash
+import settings
+
+
+class FileSink:
+    '''将输出写入文件'''
+
+    def __init__(self, path, mode="wb"):
+        self.path = path
+        self.bytes_out = 0
+        self.write_time = 0.0
+        self._file = open(path, mode)
+
+    def write(self, chunk):
+        start = time.time()
+        self._file.write(chunk)
+        self.write_time += time.time() - start
+        self.bytes_out += len(chunk)
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+
+class HashSink:
+    '''在数据写出的同时计算摘要和字节数, 不需要再次读取文件'''
+
+    def __init__(self, algorithm=None):
+        self.algorithm = algorithm or settings.CHECKSUM_ALGORITHM
+        self._hash = new_hash(self.algorithm)
+        self.bytes = 0
+
+    def write(self, chunk):
+        self._hash.update(chunk)
+        self.bytes += len(chunk)
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+    def close(self):
+        pass
+
+
+class CounterSink:
+    '''统计输出字节数, 每满interval字节回调一次callback(bytes)'''
+
+    def __init__(self, callback=None, interval=64 * 1024 * 1024):
+        self.bytes = 0
+        self._callback = callback
+        self._interval = interval
+        self._next = interval
+
+    def write(self, chunk):
+        self.bytes += len(chunk)
+        if self._callback and self.bytes >= self._next:
+            self._callback(self.bytes)
+            self._next = self.bytes + self._interval
+
+    def close(self):
+        pass
+
+
+class LogSink:
+    '''按行将输出写入日志'''
+
+    def __init__(self, logger, prefix="", encoding=None):
+        self._logger = logger
+        self._prefix = prefix
+        self._encoding = encoding or settings.CMD_ENCODING
+        self._partial = b""
+
+    def write(self, chunk):
+        lines = (self._partial + chunk).split(b"\n")
+        self._partial = lines.pop()
+        for line in lines:
+            self._emit(line)
+
+    def _emit(self, line):
+        text = line.decode(self._encoding, errors="replace").rstrip()
+        if text:
+            self._logger.info(f"{self._prefix}{text}")
+
+    def close(self):
+        if self._partial:
+            self._emit(self._partial)
+            self._partial = b""
+
+
+class BufferSink:
+    '''将输出保存在内存中, 只适用于输出较小的命令'''
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, chunk):
+        self._chunks.append(chunk)
+
+    def getvalue(self):
+        return b"".join(self._chunks)
+
+    def close(self):
+        pass
+
+
+class StderrTail:
+    '''只保留最后若干行错误输出的环形缓冲区'''
+
+    def __init__(self, maxlen=None):
+        self._lines = deque(maxlen=maxlen or settings.STDERR_TAIL_LINES)
+        self._partial = b""
+
+    def write(self, chunk):
+        lines = (self._partial + chunk).split(b"\n")
+        self._partial = lines.pop()[-4096:]
+        self._lines.extend(lines)
+
+    def close(self):
+        if self._partial:
+            self._lines.append(self._partial)
+            self._partial = b""
+
+    def text(self, encoding=None):
+        data = b"\n".join(self._lines)
+        return data.decode(encoding or settings.CMD_ENCODING, errors="replace").strip()
+
+
+def drain(stream, sinks, chunk_size=None):
+    '''按块读取stream并写入所有sinks, 返回读取的字节数'''
+    chunk_size = chunk_size or settings.STREAM_CHUNK_SIZE
+    total = 0
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        total += len(chunk)
+        for sink in sinks:
+            sink.write(chunk)
+    return total
+
+
+def feed(source, stream, on_error=None):
+    '''将source中的数据块写入stream(通常是子进程的标准输入)
+
+    下游提前退出导致的管道错误忽略, 以下游命令的退出码为准. source本身抛出异常(例如损坏的压缩文件)时
+    数据不完整, 先调用on_error(异常)再关闭stream, 调用方需要在on_error中结束下游命令,
+    否则下游会把截断的输入当作正常结束.
+    '''
+    try:
+        for chunk in source:
+            try:
+                stream.write(chunk)
+            except OSError:
+                break
+    except Exception as e:
+        if on_error:
+            on_error(e)
+    finally:
+        try:
+            stream.close()
+        except (BrokenPipeError, OSError):
+            pass
+
+
+def iter_file(path, chunk_size=None):
+    '''按块读取文件, 可以作为run_pipeline的source'''
+    chunk_size = chunk_size or settings.STREAM_CHUNK_SIZE
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+def fsync_path(path):
+    '''将文件(目录时为目录中的所有文件)刷到磁盘'''
+    files = [entry.path for entry in os.scandir(path) if entry.is_file()] if os.path.isdir(path) else [path]
+    # Windows中fsync需要可写的文件描述符
+    flags = os.O_RDWR if os.name == "nt" else os.O_RDONLY
+    for file in files:
+        fd = os.open(file, flags)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def start_thread(target, *args):
+    thread = threading.Thread(target=target, args=args, daemon=True)
+    thread.start()
+    return thread
+
+
+def read_proc_io(pid):
+    '''读取/proc/<pid>/io中的I/O统计, 不存在或没有权限时返回空字典'''
+    try:
+        with open(f"/proc/{pid}/io", "r") as f:
+            return {key: int(value) for key, _, value in (line.partition(":") for line in f)}
+    except (OSError, ValueError):
+        return {}
+
+
+def program_name(cmd):
+    if isinstance(cmd, str):
+        return cmd.split(None, 1)[0] if cmd.strip() else cmd
+    return os.path.basename(str(cmd[0]))
+
+
+def wait_process(proc, cmd):
+    '''等待子进程结束, 返回(退出码, ProcessUsage)
+
+    先用waitid(WNOWAIT)等待进程退出但不回收, 这时还能读取/proc/<pid>/io, 再用wait4回收并取得rusage.
+    不支持wait4的系统(Windows)只返回退出码, 资源使用为None.
+    不记录ru_maxrss: Linux中它在exec后不会重置, 得到的是fork时父进程的内存, 不是命令本身的内存.
+    '''
+    if not hasattr(os, "wait4"):
+        return proc.wait(), None
+    try:
+        io = {}
+        if hasattr(os, "waitid"):
+            os.waitid(os.P_PID, proc.pid, os.WEXITED | os.WNOWAIT)
+            io = read_proc_io(proc.pid)
+        _, status, rusage = os.wait4(proc.pid, 0)
+    except ChildProcessError:
+        # 已经被其他地方回收
+        return proc.wait(), None
+    proc.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+    usage = ProcessUsage(program=program_name(cmd), pid=proc.pid, user_time=rusage.ru_utime,
+                         system_time=rusage.ru_stime, read_bytes=io.get("read_bytes"), write_bytes=io.get("write_bytes"),
+                         voluntary_switches=rusage.ru_nvcsw, involuntary_switches=rusage.ru_nivcsw)
+    return proc.returncode, usage
+
+
+def make_result(returncodes, tails, nbytes, start, encoding=None, retries=0, usage=()):
+    '''根据退出码和错误输出生成RunResult, retries为打开通道时重连的次数, usage为每个子进程的ProcessUsage'''
+    status = all(code == 0 for code in returncodes)
+    texts = [tail.text(encoding) for tail in tails]
+    msg = "\n".join(text for text in texts if text)
+    if not status and not msg:
+        msg = f"命令执行失败, 退出码:{returncodes}"
+    return RunResult(status=status, msg=msg, returncodes=returncodes, bytes=nbytes, elapsed=time.time() - start,
+                     retries=retries, usage=tuple(usage))
+
+
+def run_pipeline(cmds, sinks=(), source=None, chunk_size=None, tail_lines=None):
+    '''执行命令管道(cmd1 | cmd2 | ...), 以流的方式将最后一个命令的输出写入sinks
+
+    cmds中的每个命令可以是参数列表, 也可以是交给shell执行的字符串.
+    source为可选的数据块迭代器, 会写入第一个命令的标准输入, 读取source失败时结束所有命令并返回失败.
+    所有sinks在结束时都会被关闭, 成功与否以每个命令的退出码为准.
+    '''
+    start = time.time()
+    procs, tails, threads, source_errors = [], [], [], []
+
+    def abort(error):
+        source_errors.append(error)
+        for proc in procs:
+            proc.kill()
+
+    prev_stdout = None
+    nbytes = 0
+    try:
+        for index, cmd in enumerate(cmds):
+            if index:
+                stdin = prev_stdout
+            else:
+                stdin = subprocess.PIPE if source is not None else None
+            proc = subprocess.Popen(cmd, stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                    shell=isinstance(cmd, str))
+            if prev_stdout:
+                # 关闭父进程持有的管道端, 下游退出时上游才能收到SIGPIPE
+                prev_stdout.close()
+            prev_stdout = proc.stdout
+            procs.append(proc)
+
+            tail = StderrTail(tail_lines)
+            tails.append(tail)
+            threads.append(start_thread(drain, proc.stderr, [tail], chunk_size))
+
+        if source is not None:
+            threads.append(start_thread(feed, source, procs[0].stdin, abort))
+
+        nbytes = drain(procs[-1].stdout, sinks, chunk_size)
+        waited = [wait_process(proc, cmd) for proc, cmd in zip(procs, cmds)]
+        returncodes = [returncode for returncode, _ in waited]
+        for thread in threads:
+            thread.join()
+    except BaseException:
+        for proc in procs:
+            if proc.poll() is None:
+                proc.kill()
+        raise
+    finally:
+        for sink in sinks:
+            sink.close()
+        for proc in procs:
+            proc.stdout.close()
+            proc.stderr.close()
+
+    for tail in tails:
+        tail.close()
+    result = make_result(returncodes, tails, nbytes, start, usage=[usage for _, usage in waited if usage])
+    if source_errors:
+        error = source_errors[0]
+        result = result._replace(status=False, msg=f"读取输入数据失败: {type(error).__name__}: {error}")
+    return result
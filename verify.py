@@ -0,0 +1,141 @@
+import os
+import sys
+import json
+import time
+import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from core import get_logger
+from dedup import ChunkStore
+from utils.checksum import SIDECAR_SUFFIX, new_hash, read_sidecar
+from utils.compress import get_codec, iter_decompress
+import settings
+
+logger = get_logger()
+# 没有旁路摘要时也需要检查的备份文件
+ARTIFACT_SUFFIX = (".gz", ".zst", ".lz4", ".sql", ".copy")
+
+
+def iter_plain(path, chunk_size):
+    '''以大块顺序读取文件'''
+    with open(path, "rb", buffering=0) as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+def verify_file(path, chunk_size=None):
+    '''校验单个备份文件, 在子进程中执行
+
+    有旁路摘要时按其记录的算法和范围重新计算并比较, 没有时只检查压缩文件能否完整解压.
+    '''
+    chunk_size = chunk_size or settings.VERIFY_CHUNK_SIZE
+    start = time.time()
+    record = read_sidecar(path)
+    report = {"file": path, "status": False, "checked": "digest" if record else "decompress", "bytes": 0,
+              "file_bytes": 0, "error": None}
+    try:
+        if not os.path.exists(path):
+            # 旁路摘要还在, 备份文件已经不存在
+            raise FileNotFoundError("文件不存在")
+        report["file_bytes"] = os.path.getsize(path)
+        hasher = new_hash(record["algorithm"] if record else None)
+        if path.endswith(".json"):
+            # 去重仓库中的备份清单, 按顺序读取所有块
+            chunks = ChunkStore.for_manifest(path).iter_restore(path)
+        elif get_codec(path) and not (record and record.get("scope") == "file"):
+            chunks = iter_decompress(path, chunk_size)
+        else:
+            chunks = iter_plain(path, chunk_size)
+        nbytes = 0
+        for chunk in chunks:
+            hasher.update(chunk)
+            nbytes += len(chunk)
+        report["bytes"] = nbytes
+        if not record:
+            report["status"] = True
+        elif nbytes != record["bytes"]:
+            report["error"] = f"大小不一致, 记录:{record['bytes']}字节, 实际:{nbytes}字节"
+        elif hasher.hexdigest() != record["digest"]:
+            report["error"] = f"摘要不一致, 记录:{record['digest']}, 实际:{hasher.hexdigest()}"
+        else:
+            report["status"] = True
+    except Exception as e:
+        report["error"] = f"{type(e).__name__}: {e}"
+    report["elapsed"] = round(time.time() - start, 3)
+    return report
+
+
+class IntegrityScanner:
+    '''使用进程池并发校验备份目录中的所有备份文件, 并生成JSON报告'''
+
+    def __init__(self, path, workers=None, report_file=None):
+        self._path = path
+        self._workers = workers or settings.VERIFY_PROCESS_NUM
+        self._report_file = report_file or os.path.join(path, "integrity_report.json")
+
+    def find_files(self):
+        '''查找需要校验的文件: 有旁路摘要的文件和已知后缀的备份文件'''
+        files = []
+        stack = [self._path]
+        while stack:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        # 去重仓库中的块通过清单校验
+                        if entry.name != "chunks":
+                            stack.append(entry.path)
+                    elif entry.name.endswith(SIDECAR_SUFFIX):
+                        file = entry.path[:-len(SIDECAR_SUFFIX)]
+                        # 没有后缀的文件由旁路文件带入
+                        if not file.endswith(ARTIFACT_SUFFIX):
+                            files.append(file)
+                    elif entry.name.endswith(ARTIFACT_SUFFIX):
+                        files.append(entry.path)
+        return files
+
+    def run(self):
+        '''执行校验, 返回报告字典'''
+        files = self.find_files()
+        logger.info(f"开始校验[{self._path}]中的{len(files)}个备份文件(进程数:{self._workers}), 请等待完成...")
+        start = time.time()
+        results = []
+        with ProcessPoolExecutor(max_workers=self._workers) as executor:
+            # 先提交大文件, 避免最后只剩一个大文件在校验
+            files.sort(key=lambda file: os.path.getsize(file) if os.path.exists(file) else 0, reverse=True)
+            tasks = [executor.submit(verify_file, file) for file in files]
+            for task in as_completed(tasks):
+                result = task.result()
+                if not result["status"]:
+                    logger.error(f"校验文件[{result['file']}]失败: {result['error']}")
+                results.append(result)
+        elapsed = time.time() - start
+
+        read_bytes = sum(result["file_bytes"] for result in results)
+        data_bytes = sum(result["bytes"] for result in results)
+        failed = [result["file"] for result in results if not result["status"]]
+        report = {
+            "path": os.path.abspath(self._path),
+            "finished": datetime.datetime.now().isoformat(),
+            "workers": self._workers,
+            "files": len(results),
+            "failed": len(failed),
+            "unverified": sum(1 for result in results if result["checked"] == "decompress"),
+            "elapsed": round(elapsed, 3),
+            "read_bytes": read_bytes,
+            "data_bytes": data_bytes,
+            "read_speed": round(read_bytes / 1024 / 1024 / elapsed, 1) if elapsed else 0.0,
+            "data_speed": round(data_bytes / 1024 / 1024 / elapsed, 1) if elapsed else 0.0,
+            "results": sorted(results, key=lambda result: result["file"]),
+        }
+        with open(self._report_file, "w") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        logger.info(f"校验完成, 共{len(results)}个文件, 失败{len(failed)}个, 耗时:{elapsed:.1f}秒, "
+                    f"读取速度:{report['read_speed']}MB/s, 报告:{self._report_file}")
+        return report
+
+
+if __name__ == "__main__":
+    IntegrityScanner(sys.argv[1] if len(sys.argv) > 1 else ".").run()
@@ -4,6 +4,8 @@ from PyQt5.QtCore import Qt
 from PyQt5.QtWidgets import QApplication, QDesktopWidget, QWidget, QGridLayout, QMessageBox
 
 from backup import LocalBackup, RemoteBackup
+from fleet import FleetBackup
+from verify import IntegrityScanner
 from mixins.lineEdit import PortLineEditMixin, BkPathLineEditMixin, DataPathLineEditMixin, TableLineEditMixin, \
     UserLineEditMixin, PasswdLineEditMixin, HostLineEditMixin
 from mixins.comboBox import HostComboxMixin, DbComboBoxMixin, PgpassComboBoxMinxin
@@ -159,6 +161,39 @@ class BackupWindow(HostComboxMixin, PortLineEditMixin, DbCheckBoxMixin, BkPathLi
             QMessageBox.warning(None, "warning", str(e))
 
 
+class FleetBackupWindow(PortLineEditMixin, BkPathLineEditMixin, CommitPushButtonMixin, GenericsWindow):
+    '''全部主机备份窗口'''
+
+    def __init__(self):
+        super().__init__(title="全部主机备份窗口")
+
+    def commit(self):
+        try:
+            port = int(self.le_port.text())
+            bk_path = self.le_bk_path.text()
+            FleetBackup(port=port, bk_path=bk_path).run()
+        except Exception as e:
+            QMessageBox.warning(None, "warning", str(e))
+
+
+class VerifyWindow(BkPathLineEditMixin, CommitPushButtonMixin, GenericsWindow):
+    '''备份校验窗口'''
+
+    def __init__(self):
+        super().__init__(title="备份校验窗口")
+
+    def commit(self):
+        try:
+            bk_path = self.le_bk_path.text()
+            report = IntegrityScanner(bk_path).run()
+            if report["failed"]:
+                QMessageBox.warning(self, "warning", f"{report['failed']}个备份文件校验失败, 请查看校验报告")
+            else:
+                QMessageBox.about(self, "success", f"{report['files']}个备份文件校验成功")
+        except Exception as e:
+            QMessageBox.warning(None, "warning", str(e))
+
+
 class RestoreWindow(PortLineEditMixin, DbCheckBoxMixin, DataPathLineEditMixin, CommitPushButtonMixin, GenericsWindow):
     '''数据库恢复窗口'''
 
@@ -175,6 +210,28 @@ class RestoreWindow(PortLineEditMixin, DbCheckBoxMixin, DataPathLineEditMixin, C
             QMessageBox.warning(None, "warning", str(e))
 
 
+class RestoreTestWindow(PortLineEditMixin, DbCheckBoxMixin, DataPathLineEditMixin, CommitPushButtonMixin,
+                        GenericsWindow):
+    '''恢复测试窗口'''
+
+    def __init__(self):
+        super().__init__(title="恢复测试窗口")
+
+    def commit(self):
+        try:
+            port = int(self.le_port.text())
+            data_path = self.le_data_path.text()
+            local_bk = LocalBackup("127.0.0.1", port, self.dbs)
+            results = [local_bk.restore_test(db, data_path) for db in self.dbs]
+            text = "\n".join(result.msg for result in results)
+            if all(result.status for result in results):
+                QMessageBox.about(self, "success", text)
+            else:
+                QMessageBox.warning(self, "warning", text)
+        except Exception as e:
+            QMessageBox.warning(None, "warning", str(e))
+
+
 class StructBackupWindow(HostComboxMixin, PortLineEditMixin, DbCheckBoxMixin, BkPathLineEditMixin,
                          CommitPushButtonMixin, GenericsWindow):
     '''数据库结构备份窗口'''